@@ -0,0 +1,42 @@
+"""Time building aligned sequences from edit operations as the number of edits
+grows (should scale linearly)
+
+    python benchmarks/bench_align.py
+"""
+import random
+import timeit
+from editops import Alignment, editops
+
+
+def noisy_words(rng, length, vocabulary, error_rate=0.5):
+    """Generate a word sequence and a noisy copy of it"""
+    s = [rng.choice(vocabulary) for _ in range(length)]
+    t = []
+    for w in s:
+        r = rng.random()
+        if r < error_rate / 3:
+            continue
+        elif r < 2 * error_rate / 3:
+            t.extend((w, rng.choice(vocabulary)))
+        elif r < error_rate:
+            t.append(rng.choice(vocabulary))
+        else:
+            t.append(w)
+    return s, t
+
+
+def bench(length, number=3, seed=0):
+    rng = random.Random(seed)
+    vocabulary = [f'w{i}' for i in range(1000)]
+    s_words, t_words = noisy_words(rng, length, vocabulary)
+    ops = editops(*Alignment._encode_words(s_words, t_words))
+    apply = lambda: Alignment._apply_editops(len(s_words), ops)
+    seconds = min(timeit.repeat(apply, number=number, repeat=3)) / number
+    return seconds, len(ops)
+
+
+if __name__ == '__main__':
+    print(f'{"words":>8} {"edits":>8} {"align (ms)":>12} {"per edit (us)":>14}')
+    for length in (1000, 4000, 16000, 64000):
+        seconds, edits = bench(length)
+        print(f'{length:>8} {edits:>8} {1e3 * seconds:>12.2f} {1e6 * seconds / edits:>14.2f}')
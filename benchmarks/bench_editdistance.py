@@ -0,0 +1,31 @@
+"""Compare the bit-parallel edit distance engine to the cost matrix DP
+
+    python benchmarks/bench_editdistance.py
+"""
+import random
+import timeit
+from editops.editops import editdistance, _editdistance_dp
+
+
+def random_pair(rng, length, alphabet, error_rate=0.2):
+    """Generate a string and a noisy copy of it"""
+    s = [rng.choice(alphabet) for _ in range(length)]
+    t = [rng.choice(alphabet) if rng.random() < error_rate else c for c in s]
+    return ''.join(s), ''.join(t)
+
+
+def bench(length, alphabet='abcdefghijklmnopqrstuvwxyz ', number=None, seed=0):
+    rng = random.Random(seed)
+    s, t = random_pair(rng, length, alphabet)
+    assert editdistance(s, t) == _editdistance_dp(s, t)
+    number = number or max(1, 200000 // length)
+    dp = min(timeit.repeat(lambda: _editdistance_dp(s, t), number=number, repeat=3))
+    bp = min(timeit.repeat(lambda: editdistance(s, t), number=number, repeat=3))
+    return 1e6 * dp / number, 1e6 * bp / number
+
+
+if __name__ == '__main__':
+    print(f'{"length":>8} {"dp (us)":>12} {"bit-parallel (us)":>18} {"speedup":>8}')
+    for length in (16, 32, 64, 128, 256, 1024, 4096):
+        dp, bp = bench(length)
+        print(f'{length:>8} {dp:>12.2f} {bp:>18.2f} {dp / bp:>8.1f}')
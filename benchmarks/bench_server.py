@@ -0,0 +1,96 @@
+"""Load generator measuring the throughput and latency of the scoring server
+
+    python benchmarks/bench_server.py --requests 20000 --connections 8 --jobs 4
+
+starts a server in process (or targets a running one with --port) and sends
+random pairs over several connections, each keeping a window of requests in flight
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from editops.server import ScoringServer
+
+
+def random_pair(rng, vocabulary, error_rate=0.2):
+    words = [rng.choice(vocabulary) for _ in range(rng.randint(5, 30))]
+    noisy = [rng.choice(vocabulary) if rng.random() < error_rate else w for w in words]
+    return ' '.join(noisy), ' '.join(words)
+
+
+async def client(host, port, requests, window, latencies):
+    """Send requests over one connection with up to window of them in flight"""
+    reader, writer = await asyncio.open_connection(host, port, limit=1 << 24)
+    sent = {}
+    slots = asyncio.Semaphore(window)
+
+    async def receive():
+        for _ in range(len(requests)):
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - sent.pop(response['id']))
+            slots.release()
+
+    receiver = asyncio.ensure_future(receive())
+    for request in requests:
+        await slots.acquire()
+        sent[request['id']] = time.perf_counter()
+        writer.write(json.dumps(request).encode('utf-8') + b'\n')
+        await writer.drain()
+    await receiver
+    writer.write(b'{"op": "aggregate"}\n')
+    totals = json.loads(await reader.readline())
+    writer.close()
+    return totals
+
+
+async def bench(args):
+    rng = random.Random(0)
+    vocabulary = [f'w{i}' for i in range(1000)]
+    requests = []
+    for i in range(args.requests):
+        hyp, ref = random_pair(rng, vocabulary)
+        requests.append(dict(id=i, hyp=hyp, ref=ref, analysis=args.analysis))
+
+    server = None
+    port = args.port
+    if port is None:
+        server = ScoringServer(args.jobs, args.queue_size)
+        port = (await server.start(args.host, 0)).sockets[0].getsockname()[1]
+
+    latencies = []
+    start = time.perf_counter()
+    shards = [requests[c::args.connections] for c in range(args.connections)]
+    totals = await asyncio.gather(*[client(args.host, port, shard, args.window, latencies)
+                                    for shard in shards])
+    elapsed = time.perf_counter() - start
+    if server is not None:
+        await server.close()
+
+    latencies.sort()
+    percentile = lambda p: 1e3 * latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+    print(json.dumps({
+        'requests': len(latencies),
+        'connections': args.connections,
+        'jobs': args.jobs,
+        'throughput (pairs/s)': round(len(latencies) / elapsed, 1),
+        'p50 (ms)': round(percentile(0.50), 3),
+        'p99 (ms)': round(percentile(0.99), 3),
+        'corpus WER': round(max(totals, key=lambda t: t['samples'])['WER'], 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the scoring server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', default=None, type=int,
+                        help='Port of a running server (a server is started in process if unset)')
+    parser.add_argument('--requests', default=10000, type=int)
+    parser.add_argument('--connections', default=4, type=int)
+    parser.add_argument('--window', default=64, type=int,
+                        help='Number of requests in flight per connection')
+    parser.add_argument('--analysis', default=False, action='store_true',
+                        help='Request the full analysis of each pair')
+    parser.add_argument('-j', '--jobs', default=1, type=int)
+    parser.add_argument('--queue-size', default=1024, type=int)
+    asyncio.run(bench(parser.parse_args()))
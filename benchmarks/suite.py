@@ -0,0 +1,201 @@
+"""Benchmark suite sweeping input sizes, alphabets and error rates over the hot paths,
+writing machine readable results and optionally comparing them to a baseline
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --filter 'editdistance|align' --compare results.json
+"""
+import argparse
+import itertools
+import json
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import timeit
+from editops import (Alignment, CompiledWeights, editdistance, editdistance_batch,
+                     editops)
+from editops.analyze import analyze_pairs
+
+
+BENCHMARKS = []
+
+
+def benchmark(**grid):
+    """Register a benchmark run for every combination of the parameter grid, where the
+    benchmark function sets up its inputs and returns the callable to time"""
+    def register(f):
+        names = tuple(grid)
+        for values in itertools.product(*grid.values()):
+            BENCHMARKS.append((f.__name__, dict(zip(names, values)), f))
+        return f
+    return register
+
+
+def noisy_pair(rng, length, alphabet, error_rate):
+    """A random sequence of length tokens and a copy with edits at error_rate"""
+    s = [rng.choice(alphabet) for _ in range(length)]
+    t = []
+    for c in s:
+        r = rng.random()
+        if r < error_rate / 3:
+            continue
+        elif r < 2 * error_rate / 3:
+            t.extend((c, rng.choice(alphabet)))
+        elif r < error_rate:
+            t.append(rng.choice(alphabet))
+        else:
+            t.append(c)
+    return s, t
+
+
+def chars(size):
+    return [chr(0x4e00 + i) for i in range(size)] if size > 26 else \
+        [chr(ord('a') + i) for i in range(size)]
+
+
+def vocabulary_words(size):
+    return [f'w{i}' for i in range(size)]
+
+
+def text_pairs(count, length, vocabulary=1000, error_rate=0.2, seed=0):
+    rng = random.Random(seed)
+    pairs = [noisy_pair(rng, length, vocabulary_words(vocabulary), error_rate) for _ in range(count)]
+    return [(' '.join(s), ' '.join(t)) for s, t in pairs]
+
+
+@benchmark(length=(16, 64, 256, 1024), alphabet=(4, 26, 1000), error_rate=(0.05, 0.3))
+def bench_editdistance(length, alphabet, error_rate):
+    s, t = noisy_pair(random.Random(0), length, chars(alphabet), error_rate)
+    s, t = ''.join(s), ''.join(t)
+    return lambda: editdistance(s, t)
+
+
+@benchmark(length=(16, 64, 256, 1024), alphabet=(4, 26), error_rate=(0.05, 0.3))
+def bench_editops(length, alphabet, error_rate):
+    s, t = noisy_pair(random.Random(0), length, chars(alphabet), error_rate)
+    s, t = ''.join(s), ''.join(t)
+    return lambda: editops(s, t)
+
+
+@benchmark(batch=(1, 100, 10000), length=(32, 256))
+def bench_editdistance_batch(batch, length):
+    rng = random.Random(0)
+    pairs = [noisy_pair(rng, length, chars(26), 0.2) for _ in range(batch)]
+    hyps, refs = [''.join(s) for s, t in pairs], [''.join(t) for s, t in pairs]
+    return lambda: editdistance_batch(hyps, refs)
+
+
+@benchmark(words=(10, 100, 1000), vocabulary=(10, 1000), error_rate=(0.05, 0.3))
+def bench_align(words, vocabulary, error_rate):
+    (hyp, ref), = text_pairs(1, words, vocabulary, error_rate)
+    # a word level alignment with its metrics (n-grams are timed separately)
+    return lambda: Alignment(hyp, ref, m=2, n=1)._align()
+
+
+@benchmark(words=(10, 100, 1000), n=(2, 8))
+def bench_ngrams(words, n):
+    (hyp, ref), = text_pairs(1, words)
+    a = Alignment(hyp, ref, m=2, n=n)
+    a.WER, a.SWER
+    return a._grams
+
+
+@benchmark(words=(100, 1000, 10000), weights=('dict', 'compiled'))
+def bench_weighted_counts(words, weights):
+    (hyp, ref), = text_pairs(1, words, vocabulary=5000, error_rate=0.3)
+    table = dict((w, 0.5 + i % 3) for i, w in enumerate(vocabulary_words(2500)))
+    table = CompiledWeights(table) if weights == 'compiled' else table
+    a = Alignment(hyp, ref, weights=table, m=2, n=1)
+    a.SWER
+    correct, deleted, inserted = a._correct, a._deleted, a._inserted
+    return lambda: Alignment._weighted_counts(correct, deleted, inserted, a.weights)
+
+
+@benchmark(pairs=(100, 1000), words=(20, ))
+def bench_aggregate(pairs, words):
+    hyps, refs = zip(*text_pairs(pairs, words, vocabulary=100))
+    return lambda: Alignment.aggregate(hyps, refs, keep_analyses=False)
+
+
+@benchmark(pairs=(1000, ), words=(20, ), output=(False, True))
+def bench_analyze(pairs, words, output):
+    pairs = text_pairs(pairs, words)
+    return lambda: list(analyze_pairs(pairs, output=output))
+
+
+def measure(f, repeat=5, min_time=0.05):
+    """Time f, calling it enough times per repeat to take at least min_time seconds"""
+    timer = timeit.Timer(f)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / elapsed)) if elapsed < min_time else number
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return dict(number=number, repeat=repeat, min=min(times), median=statistics.median(times))
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(python=platform.python_version(), machine=platform.machine(),
+                processor=platform.processor(), platform=platform.platform(), commit=commit)
+
+
+def key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, baseline, threshold):
+    """Return the results which are more than threshold times slower than baseline"""
+    baseline = dict((key(b), b) for b in baseline['results'])
+    regressions = []
+    for r in results:
+        b = baseline.get(key(r))
+        if b is not None and r['min'] > threshold * b['min']:
+            regressions.append(dict(r, baseline=b['min'], ratio=r['min'] / b['min']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the benchmark suite')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Path at which to store the results (json)')
+    parser.add_argument('--filter', default=None,
+                        help='Only run benchmarks whose names match this regular expression')
+    parser.add_argument('--compare', default=None,
+                        help='Results (json) to compare against, exiting with an error if any '
+                             'benchmark regressed')
+    parser.add_argument('--threshold', default=1.25, type=float,
+                        help='Slowdown (ratio of minimum times) counted as a regression')
+    parser.add_argument('--repeat', default=5, type=int)
+    parser.add_argument('--min-time', default=0.05, type=float,
+                        help='Minimum duration (seconds) of each timed repeat')
+    args = parser.parse_args()
+
+    results = []
+    for name, params, f in BENCHMARKS:
+        name = name[len('bench_'):]
+        if args.filter is not None and not re.search(args.filter, name):
+            continue
+        result = dict(name=name, params=params, **measure(f(**params), args.repeat, args.min_time))
+        results.append(result)
+        print(f'{name:<22} {json.dumps(params):<58} {1e6 * result["min"]:>12.2f} us',
+              file=sys.stderr)
+
+    report = dict(environment=environment(), results=results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for r in regressions:
+            print(f'regression: {r["name"]} {json.dumps(r["params"])} '
+                  f'{r["ratio"]:.2f}x slower than baseline', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -1,2 +1,5 @@
-from .editops import editops, editdistance
-from .alignment import Alignment
+from .editops import (editops, editdistance, editops_batch, editdistance_batch,
+                      editops_ids, editdistance_ids, score_pair, ErrorCounts, CodePoints,
+                      IncrementalAligner, PreparedReference)
+from .alignment import Alignment, Aggregator, CompiledWeights, Vocabulary
+from .profiling import Profile
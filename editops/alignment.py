@@ -1,6 +1,86 @@
 """Text alignment based analysis object oriented interface"""
+import math
+from array import array
 from collections import defaultdict, Counter
-from .editops import editops, editdistance
+from .editops import (editops, editdistance, editops_ids, editdistance_ids, score_pair,
+                      ErrorCounts, PreparedReference, LINEAR_SPACE_THRESHOLD)
+from . import profiling
+
+# operation of each column of an alignment (the edit transforming s into t)
+CORRECT, DELETE, INSERT, REPLACE = 0, 1, 2, 3
+
+
+class Vocabulary:
+    """Interns tokens as compact integer ids, so a corpus of alignments sharing one
+    vocabulary (Alignment(..., vocabulary=...)) encodes each token only once"""
+
+    def __init__(self, tokens=()):
+        self.ids = {}
+        self.tokens = []
+        for token in tokens:
+            self.add(token)
+
+
+    def __len__(self):
+        return len(self.tokens)
+
+
+    def __contains__(self, token):
+        return token in self.ids
+
+
+    def add(self, token):
+        """Return the id of token, interning it if it is new"""
+        i = self.ids.get(token)
+        if i is None:
+            i = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return i
+
+
+    def encode(self, tokens):
+        """Return the ids of a sequence of tokens as an int32 array"""
+        return array('i', map(self.add, tokens))
+
+
+    def decode(self, ids):
+        """Return the tokens of a sequence of ids"""
+        return [self.tokens[i] for i in ids]
+
+
+class CompiledWeights:
+    """Saliency weights compiled into a token id indexed vector, which can be
+    shared by many `Alignment` instances (weights=CompiledWeights(...)) to
+    compute salient metrics with vectorized lookups (requires numpy)
+
+    Unweighted tokens have the default_weight given here (an `Alignment` given
+    compiled weights and a different default_weight raises ValueError)."""
+
+    def __init__(self, weights, default_weight=1.0):
+        import numpy
+        self.ids = dict((token, i) for i, token in enumerate(weights))
+        self.vector = numpy.array([weights[token] for token in self.ids] + [default_weight],
+                                  dtype=numpy.float64)
+        self.default_weight = default_weight
+
+
+    def __getitem__(self, token):
+        return self.vector[self.ids.get(token, -1)]
+
+
+    def token_ids(self, tokens):
+        """Map tokens to indices of the weight vector (unweighted tokens map to the
+        default weight at the end of the vector)"""
+        import numpy
+        get, default = self.ids.get, len(self.ids)
+        return numpy.fromiter((get(token, default) for token in tokens),
+                              dtype=numpy.intp, count=len(tokens))
+
+
+    def weighted_counts(self, correct, deleted, inserted):
+        """Compute weighted counts of hits, deletions, and insertions"""
+        return tuple(float(self.vector[self.token_ids(tokens)].sum())
+                     for tokens in (correct, deleted, inserted))
 
 
 class Alignment:
@@ -8,8 +88,19 @@ class Alignment:
     character/word level alignments with useful visual representations.
     Faster computations of WER/CER are provided when a full alignment is
     otherwise unnecessary.
+
+    The alignment is stored compactly as columns: a byte per column holding its
+    operation and the index of the s/t token in each column (-1 for gaps).
     """
 
+    __slots__ = ('s', 't', '_m', '_n', 'weights', 'word_level', 'empty', 'fill', 'color',
+                 'linear_space_threshold', 'vocabulary', 'cache', '_color_fs',
+                 '_s_tokens', '_t_tokens', '_ops', '_s_index', '_t_index',
+                 '_consecutive_correct', '_consecutive_deleted', '_consecutive_inserted',
+                 'H', 'I', 'D', 'S', 'N', 'N1', 'N2',
+                 '_WER', '_SWER', '_NWER', '_SNWER', '_MER', '_SMER', '_WIL', '_SWIL', '_CER',
+                 '_word_distance', '_N1_word', '_char_distance', '_N1_char')
+
 
     @staticmethod
     def _color_texts():
@@ -62,39 +153,50 @@ class Alignment:
 
     def __repr__(self):
         """Return a string showing a visually palatable alignment"""
-        if not hasattr(self, '_s_align'):
-            self._align()
-        for s, t in self:
-            s['repr'], t['repr'] = self._repr_aligned_word_pair(s, t,
-                colors=self._color_fs, empty=self.empty, fill=self.fill)
-        s, t = zip(*[(s['repr'], t['repr']) for s, t in self])
+        pairs = [self._repr_aligned_word_pair(s, t,
+                    colors=self._color_fs, empty=self.empty, fill=self.fill) for s, t in self]
+        s, t = zip(*pairs)
         gap = ' ' if self.word_level else ''
         return '\n'.join((gap.join(s), gap.join(t)))
 
     
     def __iter__(self):
         """Yield each word pair in the alignment"""
-        if not hasattr(self, '_s_align'):
+        if not hasattr(self, '_ops'):
             self._align()
-        for s, t in zip(self._s_align, self._t_align):
-            yield (s, t)
+        s_words, t_words = self._s_words, self._t_words
+        for op, i, j in zip(self._ops, self._s_index, self._t_index):
+            correct = op == CORRECT
+            yield (dict(text=s_words[i] if i >= 0 else None, correct=correct),
+                   dict(text=t_words[j] if j >= 0 else None, correct=correct))
 
 
-    def __init__(self, s, t, weights=None, default_weight=1.0, m=2, n=8,
-                 word_level=True, empty='*', fill='_', color=False):
+    def __init__(self, s, t, weights=None, default_weight=None, m=2, n=8,
+                 word_level=True, empty='*', fill='_', color=False,
+                 linear_space_threshold=LINEAR_SPACE_THRESHOLD, vocabulary=None, cache=None):
         self.s = s
         self.t = t
         self._m = m
         self._n = n
+        if isinstance(weights, CompiledWeights):
+            # the compiled weights carry their own default weight
+            if default_weight is not None and default_weight != weights.default_weight:
+                raise ValueError(f'default_weight {default_weight} differs from the default '
+                                 f'weight {weights.default_weight} of the compiled weights')
+        elif default_weight is None:
+            default_weight = 1.0
         if weights is None:
             weights = defaultdict((lambda : default_weight))
-        elif not isinstance(weights, defaultdict):
+        elif not isinstance(weights, (defaultdict, CompiledWeights)):
             weights = defaultdict((lambda : default_weight), weights)
         self.weights = weights
         self.word_level = word_level        
         self.empty = empty
         self.fill = fill
         self.color = color
+        self.linear_space_threshold = linear_space_threshold
+        self.vocabulary = vocabulary
+        self.cache = cache
         if color:
             self._color_fs = self._color_texts()
         else:
@@ -128,13 +230,18 @@ class Alignment:
     @staticmethod
     def _weighted_counts(correct, deleted, inserted, weights):
         """Compute weighted counts of hits, deletions, and insertions"""
+        if isinstance(weights, CompiledWeights):
+            return weights.weighted_counts(correct, deleted, inserted)
+        correct_counts = Counter(correct)
+        deleted_counts = Counter(deleted)
+        inserted_counts = Counter(inserted)
         wH, wD, wI = 0, 0, 0
         for token in set(correct + deleted + inserted):
             w = weights[token] if weights is not None else 1
-            wH += w * correct.count(token)
-            wD += w * deleted.count(token)
-            wI += w * inserted.count(token)
-        return wH, wD, wI        
+            wH += w * correct_counts[token]
+            wD += w * deleted_counts[token]
+            wI += w * inserted_counts[token]
+        return wH, wD, wI
 
 
     @staticmethod
@@ -175,96 +282,257 @@ class Alignment:
         return grams
 
 
-    def _align(self):
-        """Compute a full alignment and store associated analysis"""
-        if self.word_level:
-            s_words = self.s.split()
-            t_words = self.t.split()
-        else:
-            s_words = list(self.s)
-            t_words = list(self.t)
+    @staticmethod
+    def _subtract_grams(grams, removed):
+        """Remove the first occurrence in grams of each gram in removed (as repeated
+        calls to list.remove would) in a single pass over both lists"""
+        pending = Counter(removed)
+        remaining = []
+        for gram in grams:
+            if pending[gram] > 0:
+                pending[gram] -= 1
+            else:
+                remaining.append(gram)
+        if +pending:
+            raise ValueError('grams to remove are missing from the list')
+        return remaining
+
 
+    @staticmethod
+    def _encode_words(s_words, t_words):
+        """Map each distinct word to a character so word sequences can be compared as strings"""
         words = set(s_words + t_words)
         w2c = dict((w, chr(j)) for j, w in enumerate(words))
         s_chars = [w2c[w] for w in s_words]
         t_chars = [w2c[w] for w in t_words]
-        state = s_words[:]
-        s, t = ''.join(s_chars), ''.join(t_chars)
-        s_align = [dict(text=c, correct=True) for c in s_words]
-        t_align = [dict(text=c, correct=True) for c in t_words]
-        deleted, inserted = [], []
+        return ''.join(s_chars), ''.join(t_chars)
+
+
+    def _token_distance(self, s_words, t_words, max_distance=-1):
+        """Compute the edit distance between two token sequences"""
+        profile = profiling.current
+        if profile is not None:
+            start = profiling.clock()
+        if self.vocabulary is None:
+            s, t = self._encode_words(s_words, t_words)
+        else:
+            s, t = self.vocabulary.encode(s_words), self.vocabulary.encode(t_words)
+        if profile is not None:
+            start = profile.lap('vocabulary', start)
+        if self.vocabulary is None:
+            distance = editdistance(s, t, max_distance=max_distance)
+        else:
+            distance = editdistance_ids(s, t, max_distance=max_distance)
+        return distance
+
+
+    @staticmethod
+    def _max_edits_below(threshold, N1):
+        """Compute a bound on the number of edits beyond which an error rate
+        over N1 reference tokens cannot be below threshold"""
+        # NOTE: mirrors the approximation used when N1 == 0 (rate == 100 * edits)
+        return max(0, math.ceil(threshold * (N1 if N1 else 1) / 100.0))
+
+
+    @staticmethod
+    def _apply_editops(m, ops):
+        """Compute the columns of the alignment of m tokens of s in one forward pass
+        over ops, returning the operation and s/t token index of each column along
+        with the number of delete, insert and replace operations"""
+        columns = bytearray()
+        s_index, t_index = array('i'), array('i')
         D, I, S = 0, 0, 0
-        for opt, spos, dpos in editops(s, t):
+        i, j = 0, 0
+        for opt, spos, dpos in ops:
+            # tokens between consecutive edit operations are aligned correctly
+            if i < spos:
+                columns.extend(bytes(spos - i))
+                s_index.extend(range(i, spos))
+                t_index.extend(range(j, j + spos - i))
+                j += spos - i
+                i = spos
             if opt == 'delete':
-                inserted.append(state.pop(spos + I - D))
-                s_align[spos + I]['correct'] = False
-                t_align.insert(dpos + D, dict(text=None, correct=False))
+                columns.append(DELETE)
+                s_index.append(i)
+                t_index.append(-1)
+                i += 1
                 D += 1
             elif opt == 'insert':
-                deleted.append(t_words[dpos])
-                state.insert(spos + I - D, t_words[dpos])
-                s_align.insert(spos + I, dict(text=None, correct=False))
-                t_align[spos + I]['correct'] = False
+                columns.append(INSERT)
+                s_index.append(-1)
+                t_index.append(j)
+                j += 1
                 I += 1
             elif opt == 'replace':
-                inserted.append(state[spos + I - D])
-                deleted.append(t_words[dpos])
-                state[spos + I - D] = t_words[dpos]
-                s_align[spos + I]['correct'] = False
-                t_align[spos + I]['correct'] = False
+                columns.append(REPLACE)
+                s_index.append(i)
+                t_index.append(j)
+                i += 1
+                j += 1
                 S += 1
             else:
                 raise ValueError('unexpected edit operation "%s"' % opt)
+        columns.extend(bytes(m - i))
+        s_index.extend(range(i, m))
+        t_index.extend(range(j, j + m - i))
+        return bytes(columns), s_index, t_index, (D, I, S)
+
+
+    def _align(self):
+        """Compute a full alignment and store associated analysis"""
+        profile = profiling.current
+        if profile is not None:
+            start = profiling.clock()
+        if self.word_level:
+            s_words = self.s.split()
+            t_words = self.t.split()
+        else:
+            s_words = list(self.s)
+            t_words = list(self.t)
+        if profile is not None:
+            start = profile.lap('tokenize', start)
 
-        self._s_words = s_words
-        self._t_words = t_words
-        self._s_align = s_align
-        self._t_align = t_align
-        self._correct = [s['text'] for s in s_align if s['correct']]
-        self._deleted = deleted
-        self._inserted = inserted
-        self._incorrect = deleted + inserted
-        self._consecutive_correct  = self._count_consecutive_f(s_align,
-                                                               lambda t: t['correct'])
-        self._consecutive_deleted  = self._count_consecutive_f(s_align,
-                                                               lambda t: t['text'] is None)
-        self._consecutive_inserted = self._count_consecutive_f(t_align,
-                                                               lambda t: t['text'] is None)
+        if self.vocabulary is None:
+            s_tokens, t_tokens = s_words, t_words
+        else:
+            s_tokens, t_tokens = self.vocabulary.encode(s_words), self.vocabulary.encode(t_words)
+
+        cached = key = None
+        if self.cache is not None:
+            key = self.cache.key('alignment', self.s, self.t, self.word_level,
+                                  self.linear_space_threshold)
+            cached = self.cache.get(key)
+            if profile is not None:
+                start = profile.lap('cache', start)
+        if cached is not None:
+            columns, s_index, t_index, (D, I, S) = cached
+            s_index, t_index = array('i', s_index), array('i', t_index)
+        else:
+            if self.vocabulary is None:
+                s, t = self._encode_words(s_words, t_words)
+            else:
+                s, t = s_tokens, t_tokens
+            if profile is not None:
+                start = profile.lap('vocabulary', start)
+            if self.vocabulary is None:
+                ops = editops(s, t, linear_space_threshold=self.linear_space_threshold)
+            else:
+                ops = editops_ids(s, t, linear_space_threshold=self.linear_space_threshold)
+            # (the editops functions time themselves)
+            if profile is not None:
+                start = profiling.clock()
+            columns, s_index, t_index, (D, I, S) = self._apply_editops(len(s_words), ops)
+            if self.cache is not None:
+                self.cache.put(key, (columns, s_index.tobytes(), t_index.tobytes(), (D, I, S)))
+
+        self._s_tokens = s_tokens
+        self._t_tokens = t_tokens
+        self._ops = columns
+        self._s_index = s_index
+        self._t_index = t_index
+        self._consecutive_correct  = self._count_consecutive_f(columns,
+                                                               lambda op: op == CORRECT)
+        self._consecutive_deleted  = self._count_consecutive_f(columns,
+                                                               lambda op: op == INSERT)
+        self._consecutive_inserted = self._count_consecutive_f(columns,
+                                                               lambda op: op == DELETE)
         # switch counts of insertions/deletions to remain consistent
         # (counted insertion/deletion opertions, which are deletion/insertion mistakes)
-        self.H, self.I, self.D, self.S = len(self._correct), D, I, S
+        self.H, self.I, self.D, self.S = columns.count(CORRECT), D, I, S
         self.N = self.H + S
         self.N1 = len(t_words)
         self.N2 = len(s_words)
-
-        if self._n >= self._m:
-            # NOTE: by default the gram calculation is ignored (default n < m)
-            self._incorrect_ngrams = self._mn_grams(t_words, self._m, self._n)
-            valid_gram = lambda gram: all(w['correct'] for w in gram)
-            aligned_grams = self._mn_grams(s_align, self._m, self._n)
-            self._correct_ngrams = list(filter(valid_gram, aligned_grams))
-            for i, cg in enumerate(self._correct_ngrams):
-                cg = tuple(w['text'] for w in cg)
-                self._correct_ngrams[i] = cg
-                self._incorrect_ngrams.remove(cg)
-        else:
-            self._incorrect_ngrams = None
-            self._correct_ngrams = None
+        if profile is not None:
+            profile.lap('align', start)
 
         if self.word_level:
             self._word_level_analysis()
 
 
+    @property
+    def _s_words(self):
+        """Tokens of s (as aligned)"""
+        if self.vocabulary is None:
+            return self._s_tokens
+        return self.vocabulary.decode(self._s_tokens)
+
+
+    @property
+    def _t_words(self):
+        """Tokens of t (as aligned)"""
+        if self.vocabulary is None:
+            return self._t_tokens
+        return self.vocabulary.decode(self._t_tokens)
+
+
+    @property
+    def _correct(self):
+        """Tokens aligned correctly"""
+        s_words = self._s_words
+        return [s_words[i] for op, i in zip(self._ops, self._s_index) if op == CORRECT]
+
+
+    @property
+    def _deleted(self):
+        """Tokens of t missing from s (inserted or replaced by the edit operations)"""
+        t_words = self._t_words
+        return [t_words[j] for op, j in zip(self._ops, self._t_index)
+                if op == INSERT or op == REPLACE]
+
+
+    @property
+    def _inserted(self):
+        """Tokens of s missing from t (deleted or replaced by the edit operations)"""
+        s_words = self._s_words
+        return [s_words[i] for op, i in zip(self._ops, self._s_index)
+                if op == DELETE or op == REPLACE]
+
+
+    @property
+    def _incorrect(self):
+        return self._deleted + self._inserted
+
+
+    def _grams(self):
+        """Compute the correct and incorrect n-grams (of orders m to n) of t,
+        or None for both when n < m"""
+        if self._n < self._m:
+            return None, None
+        profile = profiling.current
+        if profile is not None:
+            start = profiling.clock()
+        s_words = self._s_words
+        incorrect = self._mn_grams(self._t_words, self._m, self._n)
+        aligned = [s_words[i] if i >= 0 else None for i in self._s_index]
+        correct_columns = [op == CORRECT for op in self._ops]
+        correct = []
+        for o in range(self._m, self._n + 1):
+            for p in range(o, len(aligned) + 1):
+                if all(correct_columns[p - o:p]):
+                    correct.append(tuple(aligned[p - o:p]))
+        incorrect = self._subtract_grams(incorrect, correct)
+        if profile is not None:
+            profile.lap('ngrams', start)
+        return correct, incorrect
+
+
     def _word_level_analysis(self):
         """Compute all word level metrics via alignment"""
-        if not hasattr(self, '_s_align'):
+        if not hasattr(self, '_ops'):
+            # the word level alignment computes this analysis
             self.word_level = True
             self._align()
+            return
 
-        D_S, I_S = len(self._deleted), len(self._inserted)
+        profile = profiling.current
+        if profile is not None:
+            start = profiling.clock()
+        correct, deleted, inserted = self._correct, self._deleted, self._inserted
+        D_S, I_S = len(deleted), len(inserted)
         f = self._compute_f(D_S, I_S, self.S)
-        wH, wD_S, wI_S = self._weighted_counts(
-            self._correct, self._deleted, self._inserted, self.weights)
+        wH, wD_S, wI_S = self._weighted_counts(correct, deleted, inserted, self.weights)
+        if profile is not None:
+            profile.lap('weights', start)
 
         if self.N1 == 0:
             # NOTE: these are technically approximate (N1 == 0 -> WER == +inf)
@@ -301,8 +569,6 @@ class Alignment:
     def mirror_editops(self, u):
         """Mirror editops of alignment on sequence u
         (compute v, where v is to u as t is to s)"""
-        if not hasattr(self, '_s_align'):
-            self._align()
         u, v = u[:], []
         for s, t in self:
             if not s['text'] is None:
@@ -322,15 +588,35 @@ class Alignment:
         if not hasattr(self, '_word_distance'):
             s_words = self.s.split()
             t_words = self.t.split()
-            words = set(s_words + t_words)
-            w2c = dict((w, chr(j)) for j, w in enumerate(words))
-            s_chars = [w2c[w] for w in s_words]
-            t_chars = [w2c[w] for w in t_words]
-            s, t = ''.join(s_chars), ''.join(t_chars)
-            self._word_distance = editdistance(s, t)
+            self._word_distance = self._token_distance(s_words, t_words)
             self._N1_word = len(t_words)
         return self._word_distance
 
+
+    def error_counts(self):
+        """Compute character and word edit distances and reference lengths together
+        (as ErrorCounts), splitting the strings only once"""
+        if not all(hasattr(self, a) for a in ('_char_distance', '_word_distance')):
+            counts = score_pair(self.s, self.t)
+            self._char_distance, self._word_distance, self._N1_char, self._N1_word = counts
+            return counts
+        return ErrorCounts(self._char_distance, self._word_distance, self._N1_char, self._N1_word)
+
+
+    def WER_below(self, threshold):
+        """Check if the word error rate is below threshold, computing the word edit
+        distance only within the band of edits that could satisfy the threshold"""
+        if not hasattr(self, '_WER'):
+            s_words = self.s.split()
+            t_words = self.t.split()
+            k = self._max_edits_below(threshold, len(t_words))
+            edits = self._token_distance(s_words, t_words, max_distance=k)
+            if edits > k:
+                return False
+            self._word_distance = edits
+            self._N1_word = len(t_words)
+        return self.WER < threshold
+
     
     @property
     def WER(self):
@@ -408,11 +694,30 @@ class Alignment:
     @property
     def char_distance(self):
         if not hasattr(self, '_char_distance'):
+            profile = profiling.current
+            if profile is not None:
+                start = profiling.clock()
             s, t = ''.join(self.s.split()), ''.join(self.t.split())
+            if profile is not None:
+                start = profile.lap('tokenize', start)
             self._char_distance = editdistance(s, t)
             self._N1_char = len(t)
         return self._char_distance
 
+
+    def CER_below(self, threshold):
+        """Check if the character error rate is below threshold, computing the character
+        edit distance only within the band of edits that could satisfy the threshold"""
+        if not hasattr(self, '_CER'):
+            s, t = ''.join(self.s.split()), ''.join(self.t.split())
+            k = self._max_edits_below(threshold, len(t))
+            edits = editdistance(s, t, max_distance=k)
+            if edits > k:
+                return False
+            self._char_distance = edits
+            self._N1_char = len(t)
+        return self.CER < threshold
+
     
     @property
     def CER(self):
@@ -452,57 +757,124 @@ class Alignment:
         return self._consecutive_inserted
 
 
-    @property
-    def analysis(self):
-        """Provide full word level analysis as a dictionary"""
-        if not self.word_level or not hasattr(self, '_s_align'):
-            self._word_level_analysis()
-
-        # compute colorless, padded representation of alignment
+    def _aligned_text(self):
+        """Compute colorless, padded representation of alignment"""
         s_aligned, t_aligned = [], []
         for u, v in self:
             u, v = self._repr_aligned_word_pair(u, v,
                     empty=self.empty, fill=self.fill)
             s_aligned.append(u)
             t_aligned.append(v)
-        s_aligned, t_aligned = ' '.join(s_aligned), ' '.join(t_aligned)
+        return ' '.join(s_aligned), ' '.join(t_aligned)
+
+
+    def fields(self, names):
+        """Provide the values of the named fields of the analysis as a tuple, computing
+        only what they need (e.g. n-grams or aligned text only when they are named)"""
+        if not self.word_level or not hasattr(self, '_ops'):
+            self._word_level_analysis()
+        computed = {'hypothesis': self.s, 'reference': self.t}
+        if 'correct_grams' in names or 'incorrect_grams' in names:
+            computed['correct_grams'], computed['incorrect_grams'] = self._grams()
+        if 'aligned_hypothesis' in names or 'aligned_reference' in names:
+            computed['aligned_hypothesis'], computed['aligned_reference'] = self._aligned_text()
+        values = []
+        for name in names:
+            if name in computed:
+                values.append(computed[name])
+            elif name in ('correct', 'incorrect', 'deleted', 'inserted'):
+                values.append(getattr(self, f'_{name}'))
+            else:
+                values.append(getattr(self, name))
+        return tuple(values)
+
+
+    @property
+    def analysis(self):
+        """Provide full word level analysis as a dictionary"""
+        if not self.word_level or not hasattr(self, '_ops'):
+            self._word_level_analysis()
+        correct_grams, incorrect_grams = self._grams()
+        CER = self.CER
+        profile = profiling.current
+        if profile is not None:
+            start = profiling.clock()
+        deleted, inserted = self._deleted, self._inserted
+        s_aligned, t_aligned = self._aligned_text()
 
         analysis = {
             'n_consecutive_correct': self._consecutive_correct,
             'n_consecutive_deleted': self._consecutive_deleted,
             'n_consecutive_inserted': self._consecutive_inserted, 
-            'correct_grams': self._correct_ngrams, 
-            'incorrect_grams': self._incorrect_ngrams, 
+            'correct_grams': correct_grams, 
+            'incorrect_grams': incorrect_grams, 
             'correct'  : self._correct, 
-            'incorrect': (self._deleted + self._inserted), 
-            'deleted'  : self._deleted, 
-            'inserted' : self._inserted, 
+            'incorrect': (deleted + inserted), 
+            'deleted'  : deleted, 
+            'inserted' : inserted, 
             'aligned_hypothesis': s_aligned,
             'aligned_reference' : t_aligned,
             'hypothesis': self.s,
             'reference' : self.t,
             'H': self.H, 'S': self.S, 'D': self.D, 'I': self.I,
             'N1': self.N1, 'N2': self.N2, 'N': self.N,
-            'CER': self.CER,
+            'CER': CER,
             'WER' : self.WER,  'SWER' : self.SWER,
             'NWER': self.NWER, 'SNWER': self.SNWER,
             'MER' : self.MER,  'SMER' : self.SMER,
             'WIL' : self.WIL,  'SWIL' : self.SWIL,
         }
+        if profile is not None:
+            profile.lap('analysis', start)
         return analysis
 
 
     @classmethod
-    def aggregate(cls, hyps, refs, **kws):
-        """FIXME
-        Aggregate word and n-gram specific statistics from a set of analyses on
-        many hypothesis references pairs.
+    def one_to_many(cls, ref, hyps, **kws):
+        """Score many hypotheses (e.g. an N-best list) against one reference, which is
+        split and prepared only once, in a single call.
 
         Args:
-            analyses (seq): Sequence of analysis results from `analyze`.
+            ref (str): The reference string (or a `PreparedReference` of it).
+            hyps (iterable): Hypothesis strings.
+            **kws: Keyword arguments for each `Alignment`.
 
         Returns:
-            2-element tuple: Lists of statistics for words and n-grams where
+            3-element tuple: The ErrorCounts of each hypothesis, an `Alignment` of each
+            hypothesis (with its WER/CER already computed, and the rest of its analysis
+            computed on demand) and the index of the oracle hypothesis (the fewest word
+            edits, then character edits, earliest first; None if there are no hypotheses).
+
+        """
+        hyps = list(hyps)
+        prepared = ref if isinstance(ref, PreparedReference) else PreparedReference(ref)
+        counts = prepared.score(hyps)
+        alignments = []
+        for hyp, c in zip(hyps, counts):
+            a = cls(hyp, prepared.reference, **kws)
+            a._char_distance, a._word_distance, a._N1_char, a._N1_word = c
+            alignments.append(a)
+        best = min(range(len(counts)), key=lambda k: (counts[k].word_edits, counts[k].char_edits),
+                   default=None)
+        return counts, alignments, best
+
+
+    @classmethod
+    def aggregate(cls, hyps, refs, keep_analyses=True, **kws):
+        """Aggregate word and n-gram specific statistics from the analyses of
+        many hypothesis reference pairs.
+
+        Args:
+            hyps (seq): Sequence of hypothesis strings.
+            refs (seq): Sequence of reference strings.
+            keep_analyses (bool): Whether to return the analysis of every pair
+                (None is returned in their place otherwise).
+            **kws: Keyword arguments for each `Alignment` (e.g. a shared
+                `vocabulary`, `CompiledWeights` and/or a `ResultCache`).
+
+        Returns:
+            3-element tuple: The per pair analyses followed by
+            lists of statistics for words and n-grams where
             each element in each list contains aggregated statistics for a single
             word or n-gram observed in `analyses`.
 
@@ -524,21 +896,72 @@ class Alignment:
                 - gram_errorrate (float): `incorrect_grams` / `gram_total` for the n-gram.
 
         """
-        analyses = [cls(h, r, **kws).analysis for h, r in zip(hyps, refs)]
-
-        counts = {
-            'correct': Counter(),
-            'incorrect': Counter(),
-            'deleted': Counter(),
-            'inserted': Counter(),
-            'correct_grams': Counter(),
-            'incorrect_grams': Counter(),
-        }
-        keys = tuple(counts.keys())
-        for e in analyses:
-            for k in keys:
-                counts[k].update(e[k])
+        aggregator = Aggregator(keep_analyses=keep_analyses)
+        for h, r in zip(hyps, refs):
+            aggregator.update(cls(h, r, **kws))
+        words, grams = aggregator.finalize()
+        return aggregator.analyses, words, grams
 
+
+class Aggregator:
+    """Incrementally accumulate word and n-gram statistics over many alignments
+    (see `Alignment.aggregate`). Aggregators of disjoint sets of alignments can be
+    merged, so a corpus can be accumulated in shards and finalized once.
+    """
+
+    labels = ('correct', 'incorrect', 'deleted', 'inserted',
+              'correct_grams', 'incorrect_grams')
+
+
+    def __init__(self, keep_analyses=False):
+        self.counts = dict((label, Counter()) for label in self.labels)
+        self.analyses = [] if keep_analyses else None
+
+
+    def update(self, alignment):
+        """Accumulate the statistics of a single alignment"""
+        if self.analyses is not None:
+            # the analysis already holds the word lists and n-grams
+            analysis = alignment.analysis
+            self.analyses.append(analysis)
+            correct, deleted, inserted = (analysis['correct'], analysis['deleted'],
+                                          analysis['inserted'])
+            correct_grams, incorrect_grams = (analysis['correct_grams'],
+                                              analysis['incorrect_grams'])
+        else:
+            if not alignment.word_level or not hasattr(alignment, '_ops'):
+                alignment._word_level_analysis()
+            correct, deleted, inserted = (alignment._correct, alignment._deleted,
+                                          alignment._inserted)
+            correct_grams, incorrect_grams = alignment._grams()
+        counts = self.counts
+        counts['correct'].update(correct)
+        counts['incorrect'].update(deleted)
+        counts['incorrect'].update(inserted)
+        counts['deleted'].update(deleted)
+        counts['inserted'].update(inserted)
+        if correct_grams is not None:
+            counts['correct_grams'].update(correct_grams)
+            counts['incorrect_grams'].update(incorrect_grams)
+        return self
+
+
+    def merge(self, other):
+        """Accumulate the statistics of another aggregator (both must keep their
+        analyses, or neither)"""
+        if (self.analyses is None) != (other.analyses is None):
+            raise ValueError('cannot merge aggregators which differ in keep_analyses')
+        for label in self.labels:
+            self.counts[label].update(other.counts[label])
+        if self.analyses is not None:
+            self.analyses.extend(other.analyses)
+        return self
+
+
+    def finalize(self):
+        """Compute lists of word and n-gram statistics from the accumulated counts
+        (the aggregator itself is left unchanged and can be updated further)"""
+        counts = dict(self.counts)
         totals = Counter()
         lexicon = set()
         for c in ('correct', 'incorrect'):
@@ -611,4 +1034,4 @@ class Alignment:
             grams.append(entry)
         grams = sorted(grams, key=(lambda g: g['gram_total']), reverse=True)
 
-        return analyses, words, grams
+        return words, grams
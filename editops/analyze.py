@@ -1,14 +1,186 @@
 """Utility entry point for analyzing one or more samples
 storing results on disk or printing to terminal"""
 import argparse
+import collections
+import contextlib
+import functools
+import itertools
 import json
+import multiprocessing
 import os
+import sys
 import tqdm
-from editops import Alignment
+from editops import Alignment, score_pair, profiling
+from editops.cache import ResultCache
+from editops.columns import column_names, NpyColumnWriter, ParquetColumnWriter
+from editops.corpus import IndexedCorpus, parse_ids, parse_range
+from editops.index import ReferenceIndex
 
 # TODO: support saliency weights from a file/string
 # TODO: support m to n order gram checking
 
+
+class PairedLines:
+    """Iterate the lines of hypothesis and reference files in lockstep, holding one line
+    of each in memory at a time, and stopping at the end of the shorter file"""
+
+    def __init__(self, hyp_file, ref_file):
+        self.hyp_file = hyp_file
+        self.ref_file = ref_file
+        self.count = 0
+        # (line number, name of the file which ended early) when the lengths differ
+        self.mismatch = None
+
+    def __iter__(self):
+        for hyp, ref in itertools.zip_longest(self.hyp_file, self.ref_file):
+            if hyp is None or ref is None:
+                self.mismatch = (self.count + 1, 'hypothesis' if hyp is None else 'reference')
+                return
+            self.count += 1
+            yield hyp.rstrip('\n'), ref.rstrip('\n')
+
+
+class NearestPairs:
+    """Pair each hypothesis with its nearest reference (see `ReferenceIndex.pair`),
+    skipping (and counting) the hypotheses with no reference within max_rate"""
+
+    def __init__(self, hyps, refs, max_rate=50.0):
+        self.hyps = hyps
+        self.index = ReferenceIndex(refs)
+        self.max_rate = max_rate
+        self.unmatched = 0
+
+    def __iter__(self):
+        for hyp, ref in self.index.pair(self.hyps, self.max_rate):
+            if ref is None:
+                self.unmatched += 1
+                continue
+            yield hyp, ref
+
+
+def analyze_pair(hyp, ref, verbose=False, output=False, fields=None):
+    """Analyze a single pair returning its edit counts (char edits, word edits,
+    reference chars, reference words) along with its optional printable alignment
+    and serialized analysis (or the tuple of its values named by fields)"""
+    profile = profiling.current
+    if not (verbose or output):
+        return tuple(score_pair(hyp, ref)), None, None
+    a = Alignment(hyp, ref, word_level=True, color=True)
+    counts = tuple(a.error_counts())
+    if verbose:
+        WER, CER = a.WER, a.CER
+        if profile is not None:
+            start = profiling.clock()
+        text = f'{a.alignment}\nWER: {WER:.02f}\nCER: {CER:.02f}'
+        if profile is not None:
+            profile.lap('format', start)
+    else:
+        text = None
+    if not output:
+        line = None
+    elif fields is None:
+        analysis = a.analysis
+        if profile is not None:
+            start = profiling.clock()
+        line = json.dumps(analysis)
+        if profile is not None:
+            profile.lap('serialize', start)
+    else:
+        # only the named fields are computed (no n-grams, and no aligned text unless
+        # named), in stages timed by the alignment itself
+        line = a.fields(fields)
+    return counts, text, line
+
+
+def analyze_chunk(pairs, verbose=False, output=False, fields=None, profile=False):
+    """Analyze a list of pairs (the unit of work of a worker process), along with
+    the `Profile` of its stages if profile"""
+    if profile:
+        with profiling.Profile() as profile:
+            results = analyze_chunk(pairs, verbose, output, fields)
+        return results, profile
+    return [analyze_pair(hyp, ref, verbose, output, fields) for hyp, ref in pairs]
+
+
+def chunked(iterable, size):
+    """Yield lists of up to size consecutive items of iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def analyze_pairs(pairs, jobs=1, chunksize=256, verbose=False, output=False, fields=None,
+                  cache=None, profile=None):
+    """Yield the results of `analyze_pair` for each pair in input order, spreading
+    chunks of pairs across a pool of jobs worker processes when jobs > 1 and only
+    analyzing pairs whose results are not in cache (a `ResultCache`) if given.
+    The stages timed by worker processes are merged into profile (a `Profile`)
+    if given (stages run in this process are timed by the active profile)"""
+    work = functools.partial(analyze_chunk, verbose=verbose, output=output, fields=fields)
+    chunks = chunked(pairs, chunksize)
+    if cache is not None:
+        chunks = cached_chunks(chunks, cache, (verbose, output, fields))
+    if jobs == 1:
+        for chunk in chunks:
+            yield from collect(chunk, work(chunk), cache)
+        return
+    if profile is not None:
+        work = functools.partial(work, profile=True)
+
+    def get(result):
+        if profile is None:
+            return result.get()
+        results, worker_profile = result.get()
+        profile.merge(worker_profile)
+        return results
+
+    with multiprocessing.Pool(jobs) as pool:
+        # bound the chunks in flight so input is consumed only as fast as it is analyzed
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.apply_async(work, (chunk, ))))
+            if len(pending) >= 2 * jobs:
+                chunk, result = pending.popleft()
+                yield from collect(chunk, get(result), cache)
+        while pending:
+            chunk, result = pending.popleft()
+            yield from collect(chunk, get(result), cache)
+
+
+class CachedChunk(list):
+    """The pairs of a chunk which are missing from the cache, along with the cache
+    keys and (partially) cached results of the whole chunk"""
+
+    def __init__(self, misses, keys, results):
+        super().__init__(misses)
+        self.keys = keys
+        self.results = results
+
+
+def cached_chunks(chunks, cache, options):
+    """Yield a CachedChunk of the pairs of each chunk which are missing from cache"""
+    for chunk in chunks:
+        keys = [cache.key('analyze_pair', hyp, ref, *options) for hyp, ref in chunk]
+        results = [cache.get(key) for key in keys]
+        misses = [pair for pair, result in zip(chunk, results) if result is None]
+        yield CachedChunk(misses, keys, results)
+
+
+def collect(chunk, results, cache=None):
+    """Combine the results analyzed for a chunk with its cached results (if any)"""
+    if cache is None:
+        return results
+    results = iter(results)
+    for x, key in enumerate(chunk.keys):
+        if chunk.results[x] is None:
+            chunk.results[x] = next(results)
+            cache.put(key, chunk.results[x])
+    return chunk.results
+
+
 if __name__ == '__main__':
     description = 'Analyze pairs of strings'
     parser = argparse.ArgumentParser(description=description)
@@ -20,50 +192,145 @@ if __name__ == '__main__':
                         help='Split the input hyp/ref text on newlines for 1 - 1 analysis')
     parser.add_argument('-o', '--output', default=None,
                         help='Optional path at which to store full alignment analysis')
+    parser.add_argument('-i', '--index', default=False, action='store_true',
+                        help='Read the lines of the hyp/ref files by random access through line '
+                             'offset indices (built once and stored next to the files)')
+    parser.add_argument('--range', default=None,
+                        help='Only analyze the samples in a START:STOP range of ids (line numbers '
+                             'from 0, implies --index)')
+    parser.add_argument('--ids', default=None,
+                        help='Only analyze the samples with these ids (line numbers from 0) given '
+                             'as a comma separated list or a file of ids (implies --index)')
+    parser.add_argument('-a', '--auto-pair', default=False, action='store_true',
+                        help='Pair each hypothesis line with its nearest reference line by edit '
+                             'distance rather than by line number (implies --lines)')
+    parser.add_argument('--max-rate', default=50.0, type=float,
+                        help='Largest number of character edits (as a percentage of the '
+                             'hypothesis length) to an automatically paired reference')
+    parser.add_argument('-f', '--format', default='jsonl', choices=('jsonl', 'npy', 'parquet'),
+                        help='Format of the output: json lines of the full analysis, or per sample '
+                             'metric columns in a directory of .npy files or a parquet file')
+    parser.add_argument('--text-columns', default=False, action='store_true',
+                        help='Also store the (aligned) hypothesis and reference text of each '
+                             'sample in the columnar output formats')
     parser.add_argument('-v', '--verbose', default=False, action='store_true',
                         help='Optional print the full alignment and WER/CER for each sample')
+    parser.add_argument('-s', '--stream', default=False, action='store_true',
+                        help='Stream the lines of the hyp/ref files (or - for stdin) in lockstep '
+                             'rather than reading them whole (implies --lines)')
+    parser.add_argument('-c', '--cache', default=None,
+                        help='Optional path of a sqlite database in which to cache the analysis '
+                             'of each pair for reuse across runs')
+    parser.add_argument('--cache-size', default=65536, type=int,
+                        help='Number of cached analyses held in memory')
+    parser.add_argument('-j', '--jobs', default=1, type=int,
+                        help='Number of worker processes analyzing samples (0 for all cores)')
+    parser.add_argument('--chunksize', default=256, type=int,
+                        help='Number of samples sent to a worker process at a time')
+    parser.add_argument('--profile', default=False, action='store_true',
+                        help='Print the time spent in each stage of the analysis (summed over '
+                             'worker processes) and the throughput at the end')
     args = parser.parse_args()
 
-    if os.path.isfile(args.hyp):
-        with open(args.hyp, 'r') as f:
-            hyp = f.read()
-    else:
-        hyp = args.hyp
+    if args.auto_pair and (args.stream or args.index or args.range is not None or
+                           args.ids is not None):
+        parser.error('--auto-pair reads whole files (it cannot be combined with --stream, '
+                     '--index, --range or --ids)')
 
-    if os.path.isfile(args.ref):
-        with open(args.ref, 'r') as f:
-            ref = f.read()
+    if args.stream:
+        if args.hyp == '-' and args.ref == '-':
+            parser.error('at most one of --hyp and --ref can be read from stdin')
+        hyp_file = sys.stdin if args.hyp == '-' else open(args.hyp, 'r')
+        ref_file = sys.stdin if args.ref == '-' else open(args.ref, 'r')
+        pairs = PairedLines(hyp_file, ref_file)
+        total = None
+    elif args.index or args.range is not None or args.ids is not None:
+        corpus = IndexedCorpus(args.hyp, args.ref)
+        # check every id before analyzing any so a bad id cannot end the run partway
+        try:
+            if args.ids is not None:
+                ids = parse_ids(args.ids, len(corpus))
+            elif args.range is not None:
+                ids = range(len(corpus))[parse_range(args.range, len(corpus))]
+            else:
+                ids = range(len(corpus))
+        except ValueError as error:
+            corpus.close()
+            parser.error(f'--{"ids" if args.ids is not None else "range"}: {error}')
+        pairs = corpus.select(ids)
+        total = len(ids)
     else:
-        ref = args.ref
+        if os.path.isfile(args.hyp):
+            with open(args.hyp, 'r') as f:
+                hyp = f.read()
+        else:
+            hyp = args.hyp
 
-    if args.lines:
-        hyps, refs = hyp.rstrip('\n').split('\n'), ref.rstrip('\n').split('\n')
-        assert len(hyps) == len(refs)
-    else:
-        hyps, refs = [hyp.rstrip('\n')], [ref.rstrip('\n')]
+        if os.path.isfile(args.ref):
+            with open(args.ref, 'r') as f:
+                ref = f.read()
+        else:
+            ref = args.ref
 
+        if args.auto_pair:
+            hyps, refs = hyp.rstrip('\n').split('\n'), ref.rstrip('\n').split('\n')
+            pairs = NearestPairs(hyps, refs, args.max_rate)
+        elif args.lines:
+            hyps, refs = hyp.rstrip('\n').split('\n'), ref.rstrip('\n').split('\n')
+            assert len(hyps) == len(refs)
+            pairs = zip(hyps, refs)
+        else:
+            hyps, refs = [hyp.rstrip('\n')], [ref.rstrip('\n')]
+            pairs = zip(hyps, refs)
+        total = len(hyps)
+
+    fields = None
     if args.output is not None:
-        output = open(args.output, 'w')
+        if args.format == 'jsonl':
+            output = open(args.output, 'w')
+        else:
+            writer = NpyColumnWriter if args.format == 'npy' else ParquetColumnWriter
+            output = writer(args.output, text=args.text_columns)
+            fields = column_names(args.text_columns)
 
     if not args.verbose:
-        pbar = tqdm.tqdm(desc='analyzing', total=len(hyps))
-
-    ref_word_count, word_edits, ref_char_count, char_edits = 0, 0, 0, 0
-    for hyp, ref in zip(hyps, refs):
-        a = Alignment(hyp, ref, word_level=True, color=True)
-        char_edits += a.char_distance
-        word_edits += a.word_distance
-        ref_char_count += a.N1_char
-        ref_word_count += a.N1_word
-
-        if args.verbose:
-            print(f'{a.alignment}\nWER: {a.WER:.02f}\nCER: {a.CER:.02f}')
-        else:
-            pbar.update(1)
+        pbar = tqdm.tqdm(desc='analyzing', total=total)
+
+    cache = None
+    if args.cache is not None:
+        cache = ResultCache(args.cache_size, args.cache)
+
+    # the profile (if any) is active while pairs are scored, and is closed even if
+    # the scoring fails
+    with contextlib.ExitStack() as stack:
+        profile = stack.enter_context(profiling.Profile()) if args.profile else None
+
+        jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+        results = analyze_pairs(pairs, jobs=jobs, chunksize=args.chunksize,
+                                verbose=args.verbose, output=args.output is not None,
+                                fields=fields, cache=cache, profile=profile)
+
+        ref_word_count, word_edits, ref_char_count, char_edits = 0, 0, 0, 0
+        samples = 0
+        for counts, text, line in results:
+            char_edits += counts[0]
+            word_edits += counts[1]
+            ref_char_count += counts[2]
+            ref_word_count += counts[3]
+            samples += 1
+
+            if args.verbose:
+                print(text)
+            else:
+                pbar.update(1)
 
-        if args.output is not None:
-            # TODO: support non-verbose json output?
-            output.write(f'{json.dumps(a.analysis)}\n')
+            if args.output is not None:
+                if profile is not None:
+                    start = profiling.clock()
+                # TODO: support non-verbose json output?
+                output.write(f'{line}\n' if fields is None else line)
+                if profile is not None:
+                    profile.lap('write', start)
 
     if args.output is not None:
         output.close()
@@ -71,6 +338,30 @@ if __name__ == '__main__':
     if not args.verbose:
         pbar.close()
 
+    if cache is not None:
+        cache.close()
+
     WER = 100.0 * word_edits / ref_word_count
     CER = 100.0 * char_edits / ref_char_count
     print('=' * 50, f'\nWER: {WER:.02f}\nCER: {CER:.02f}')
+
+    if profile is not None:
+        profile.count(pairs=samples, chars=ref_char_count)
+        print('=' * 50, file=sys.stderr)
+        print(profile.report(), file=sys.stderr)
+
+    if args.index or args.range is not None or args.ids is not None:
+        corpus.close()
+
+    if args.auto_pair and pairs.unmatched:
+        print(f'{pairs.unmatched} of {total} hypotheses had no reference within '
+              f'{args.max_rate}% edits and were skipped', file=sys.stderr)
+
+    if args.stream:
+        for f in (hyp_file, ref_file):
+            if f is not sys.stdin:
+                f.close()
+        if pairs.mismatch is not None:
+            line, name = pairs.mismatch
+            sys.exit(f'error: {name} file ended at line {line} '
+                     f'(only the first {pairs.count} lines were analyzed)')
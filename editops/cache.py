@@ -0,0 +1,138 @@
+"""Content addressed cache of computed results (alignments, analyses) keyed by a hash
+of their inputs, held in a bounded in-memory LRU optionally backed by sqlite so
+results can be reused across runs"""
+import collections
+import hashlib
+import json
+import pickle
+import sqlite3
+
+
+def dumps(value):
+    """Serialize a result (None, booleans, numbers, strings, bytes and tuples or lists
+    of them) as a length prefixed json header followed by the bytes objects, so reading
+    a result back (unlike unpickling) cannot run code"""
+    blobs = []
+
+    def encode(v):
+        if v is None or isinstance(v, (bool, int, float, str)):
+            return v
+        if isinstance(v, (bytes, bytearray, memoryview)):
+            blobs.append(bytes(v))
+            return {'b': len(blobs) - 1}
+        if isinstance(v, tuple):
+            return {'t': [encode(x) for x in v]}
+        if isinstance(v, list):
+            return [encode(x) for x in v]
+        raise TypeError(f'cannot cache a result containing {type(v).__name__}')
+
+    header = json.dumps([encode(value), [len(blob) for blob in blobs]]).encode('utf-8')
+    return len(header).to_bytes(4, 'little') + header + b''.join(blobs)
+
+
+def loads(data):
+    """Deserialize a result serialized by `dumps`"""
+    size = int.from_bytes(data[:4], 'little')
+    value, sizes = json.loads(bytes(data[4:4 + size]).decode('utf-8'))
+    blobs, offset = [], 4 + size
+    for n in sizes:
+        blobs.append(bytes(data[offset:offset + n]))
+        offset += n
+
+    def decode(v):
+        if isinstance(v, list):
+            return [decode(x) for x in v]
+        if isinstance(v, dict):
+            return tuple(decode(x) for x in v['t']) if 't' in v else blobs[v['b']]
+        return v
+
+    return decode(value)
+
+
+class ResultCache:
+    """An LRU of at most maxsize results, backed by a sqlite database at path
+    (if any) which results are written through to and read back from on misses
+
+    Results are stored in the database with `dumps` rather than pickled, so that a
+    database written by someone else can be read without running their code."""
+
+    def __init__(self, maxsize=65536, path=None, commit_interval=1024):
+        self.maxsize = maxsize
+        self.path = path
+        self.commit_interval = commit_interval
+        self.lru = collections.OrderedDict()
+        self.hits, self.misses = 0, 0
+        self.uncommitted = 0
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path)
+            # (a results table of earlier, pickled, versions is never read)
+            self.db.execute('CREATE TABLE IF NOT EXISTS stored_results '
+                            '(key BLOB PRIMARY KEY, value BLOB NOT NULL)')
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def __len__(self):
+        return len(self.lru)
+
+
+    @staticmethod
+    def key(*parts):
+        """Hash the inputs of a result (strings, numbers, booleans, None and tuples)"""
+        return hashlib.blake2b(pickle.dumps(parts, protocol=4), digest_size=16).digest()
+
+
+    def get(self, key):
+        """Return the result stored under key (or None if there is none)"""
+        value = self.lru.get(key)
+        if value is not None:
+            self.lru.move_to_end(key)
+        elif self.db is not None:
+            row = self.db.execute('SELECT value FROM stored_results WHERE key = ?',
+                                  (key, )).fetchone()
+            if row is not None:
+                value = loads(row[0])
+                self._remember(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+
+    def put(self, key, value):
+        """Store value under key (in both tiers)"""
+        self._remember(key, value)
+        if self.db is not None:
+            self.db.execute('INSERT OR REPLACE INTO stored_results VALUES (?, ?)',
+                            (key, dumps(value)))
+            self.uncommitted += 1
+            if self.uncommitted >= self.commit_interval:
+                self.commit()
+
+
+    def _remember(self, key, value):
+        self.lru[key] = value
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.maxsize:
+            self.lru.popitem(last=False)
+
+
+    def commit(self):
+        if self.db is not None and self.uncommitted:
+            self.db.commit()
+            self.uncommitted = 0
+
+
+    def close(self):
+        if self.db is not None:
+            self.commit()
+            self.db.close()
+            self.db = None
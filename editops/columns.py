@@ -0,0 +1,166 @@
+"""Columnar storage of per sample analysis metrics (a directory of .npy files or a
+parquet file) written in batches, so large evaluations can be memory-mapped
+instead of parsed back from json lines"""
+import abc
+import json
+import os
+
+
+# per sample metrics and their column (numpy) types (missing metrics are stored as nan)
+METRIC_COLUMNS = (
+    ('H', 'int64'), ('S', 'int64'), ('D', 'int64'), ('I', 'int64'),
+    ('N1', 'int64'), ('N2', 'int64'), ('N', 'int64'),
+    ('n_consecutive_correct', 'int64'),
+    ('n_consecutive_deleted', 'int64'),
+    ('n_consecutive_inserted', 'int64'),
+    ('CER', 'float64'),
+    ('WER', 'float64'), ('SWER', 'float64'),
+    ('NWER', 'float64'), ('SNWER', 'float64'),
+    ('MER', 'float64'), ('SMER', 'float64'),
+    ('WIL', 'float64'), ('SWIL', 'float64'),
+)
+
+# optional bulky text fields of each sample
+TEXT_COLUMNS = ('hypothesis', 'reference', 'aligned_hypothesis', 'aligned_reference')
+
+# size of the .npy headers, which are rewritten in place with the final row count
+NPY_HEADER_SIZE = 128
+
+
+def column_names(text=False):
+    """Names of the fields stored for each sample"""
+    names = tuple(name for name, dtype in METRIC_COLUMNS)
+    return names + TEXT_COLUMNS if text else names
+
+
+def metric_array(values, dtype):
+    """Convert a batch of metric values to an array (None becomes nan)"""
+    import numpy
+    if dtype == 'float64':
+        values = [numpy.nan if v is None else v for v in values]
+    return numpy.array(values, dtype=dtype)
+
+
+def npy_header(dtype, count):
+    """Serialize a version 1.0 .npy header of a 1d array padded to NPY_HEADER_SIZE"""
+    import numpy
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (
+        numpy.dtype(dtype).str, count)
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + '\n'
+    return b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+
+class ColumnWriter(abc.ABC):
+    """Base class of the columnar writers, which buffer rows (tuples of the fields
+    named by `column_names`) and write them one batch of columns at a time"""
+
+    def __init__(self, path, text=False, batch_size=4096):
+        self.path = path
+        self.text = text
+        self.names = column_names(text)
+        self.batch_size = batch_size
+        self.rows = []
+        self.count = 0
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+
+    def flush(self):
+        if self.rows:
+            self.write_batch(list(zip(*self.rows)))
+            self.count += len(self.rows)
+            self.rows = []
+
+
+    @abc.abstractmethod
+    def write_batch(self, columns):
+        """Write a batch of rows given as a list of columns (of the fields in order)"""
+
+
+    def close(self):
+        self.flush()
+
+
+class NpyColumnWriter(ColumnWriter):
+    """Write each metric to <path>/<name>.npy (and the optional text fields as json
+    lines to <path>/text.jsonl), rewriting the .npy headers with the final row count
+    on close so the columns can be loaded with `load_columns` (memory-mapped)"""
+
+    def __init__(self, path, text=False, batch_size=4096):
+        super().__init__(path, text, batch_size)
+        os.makedirs(path, exist_ok=True)
+        self.files = []
+        for name, dtype in METRIC_COLUMNS:
+            f = open(os.path.join(path, f'{name}.npy'), 'wb')
+            f.write(npy_header(dtype, 0))
+            self.files.append(f)
+        self.text_file = open(os.path.join(path, 'text.jsonl'), 'w') if text else None
+
+
+    def write_batch(self, columns):
+        for f, values, (name, dtype) in zip(self.files, columns, METRIC_COLUMNS):
+            f.write(metric_array(values, dtype).tobytes())
+        if self.text_file is not None:
+            texts = columns[len(METRIC_COLUMNS):]
+            for row in zip(*texts):
+                self.text_file.write(json.dumps(dict(zip(TEXT_COLUMNS, row))) + '\n')
+
+
+    def close(self):
+        self.flush()
+        for f, (name, dtype) in zip(self.files, METRIC_COLUMNS):
+            f.seek(0)
+            f.write(npy_header(dtype, self.count))
+            f.close()
+        if self.text_file is not None:
+            self.text_file.close()
+
+
+class ParquetColumnWriter(ColumnWriter):
+    """Write the metrics (and optional text fields) as one row group per batch of
+    a parquet file (requires pyarrow)"""
+
+    def __init__(self, path, text=False, batch_size=65536):
+        import numpy
+        import pyarrow
+        import pyarrow.parquet
+        super().__init__(path, text, batch_size)
+        fields = [pyarrow.field(name, pyarrow.from_numpy_dtype(numpy.dtype(dtype)))
+                  for name, dtype in METRIC_COLUMNS]
+        if text:
+            fields.extend(pyarrow.field(name, pyarrow.string()) for name in TEXT_COLUMNS)
+        self.schema = pyarrow.schema(fields)
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+
+    def write_batch(self, columns):
+        import pyarrow
+        arrays = [metric_array(values, dtype)
+                  for values, (name, dtype) in zip(columns, METRIC_COLUMNS)]
+        arrays.extend(pyarrow.array(values, pyarrow.string())
+                      for values in columns[len(METRIC_COLUMNS):])
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def load_columns(path, mmap_mode='r'):
+    """Load the metric columns written by `NpyColumnWriter` as a dict of arrays"""
+    import numpy
+    return dict((name, numpy.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode))
+                for name, dtype in METRIC_COLUMNS)
@@ -0,0 +1,170 @@
+"""Random access to the lines of large hypothesis/reference corpora through an
+index of line offsets (built once and stored next to each file) and mmap"""
+import mmap
+import os
+from array import array
+
+
+def index_path(path):
+    """Path of the line offset index of the text file at path"""
+    return f'{path}.idx'
+
+
+def build_index(path):
+    """Compute the byte offset at which each line of a file starts, followed by the
+    size of the file (so line k spans offsets[k]:offsets[k + 1])"""
+    offsets = array('q', [0])
+    size = os.path.getsize(path)
+    if size:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            find, append = mm.find, offsets.append
+            start = find(b'\n')
+            while start >= 0:
+                append(start + 1)
+                start = find(b'\n', start + 1)
+    if offsets[-1] != size:
+        offsets.append(size)
+    return offsets
+
+
+def load_index(path, rebuild=True):
+    """Load the line offset index of the file at path, (re)building and storing it if it
+    is missing, corrupt or stale (the indexed size or modification time differs from
+    the file's)
+
+    The stored index is the offsets followed by the modification time (in ns) of the
+    file when it was indexed."""
+    stat = os.stat(path)
+    offsets = array('q')
+    try:
+        with open(index_path(path), 'rb') as f:
+            offsets.frombytes(f.read())
+    except (OSError, ValueError):
+        # a missing index, or a truncated one (not a whole number of offsets)
+        offsets = array('q')
+    mtime = offsets.pop() if offsets else None
+    if not offsets or offsets[-1] != stat.st_size or mtime != stat.st_mtime_ns:
+        if not rebuild:
+            raise ValueError(f'missing or stale index of {path}')
+        offsets = build_index(path)
+        try:
+            with open(index_path(path), 'wb') as f:
+                offsets.tofile(f)
+                array('q', [stat.st_mtime_ns]).tofile(f)
+        except OSError:
+            # NOTE: the index is simply rebuilt next time if it cannot be stored
+            pass
+    return offsets
+
+
+class IndexedLines:
+    """The lines of a text file, read on demand from a memory map of the file"""
+
+    def __init__(self, path, offsets=None, encoding='utf-8'):
+        self.path = path
+        self.offsets = load_index(path) if offsets is None else offsets
+        self.encoding = encoding
+        self.file = open(path, 'rb')
+        size = self.offsets[-1]
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+    def __getitem__(self, k):
+        if not -len(self) <= k < len(self):
+            raise IndexError('line index out of range')
+        if k < 0:
+            k += len(self)
+        line = self.mm[self.offsets[k]:self.offsets[k + 1]].decode(self.encoding)
+        if line.endswith('\n'):
+            line = line[:-2] if line.endswith('\r\n') else line[:-1]
+        return line
+
+
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.file.close()
+
+
+class IndexedCorpus:
+    """Hypothesis/reference line pairs of two (indexed) files, which can be selected
+    by id (line number from 0) or ranges of ids without reading the whole files"""
+
+    def __init__(self, hyp_path, ref_path, encoding='utf-8'):
+        self.hyps = IndexedLines(hyp_path, encoding=encoding)
+        self.refs = IndexedLines(ref_path, encoding=encoding)
+        if len(self.hyps) != len(self.refs):
+            count = (len(self.hyps), len(self.refs))
+            self.close()
+            raise ValueError('hypothesis and reference files have %d and %d lines' % count)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def __len__(self):
+        return len(self.hyps)
+
+
+    def __getitem__(self, k):
+        return self.hyps[k], self.refs[k]
+
+
+    def __iter__(self):
+        return self.select(range(len(self)))
+
+
+    def select(self, ids):
+        """Yield the (hyp, ref) pairs of a sequence of ids (e.g. a range)"""
+        for k in ids:
+            yield self[k]
+
+
+    def alignments(self, ids=None, **kws):
+        """Yield an `Alignment` (constructed with kws) of the pairs of ids (all if None)"""
+        from .alignment import Alignment
+        for hyp, ref in self.select(range(len(self)) if ids is None else ids):
+            yield Alignment(hyp, ref, **kws)
+
+
+    def close(self):
+        self.hyps.close()
+        self.refs.close()
+
+
+def parse_range(text, count=None):
+    """Parse a python style START:STOP range of ids (either end can be omitted), checking
+    that both ends are within a corpus of count lines if count is given"""
+    start, sep, stop = text.partition(':')
+    if not sep:
+        raise ValueError(f'expected a START:STOP range, found "{text}"')
+    span = slice(int(start) if start else None, int(stop) if stop else None)
+    if count is not None:
+        for end in (span.start, span.stop):
+            if end is not None and not -count <= end <= count:
+                raise ValueError(f'range end {end} is outside of the {count} samples')
+    return span
+
+
+def parse_ids(text, count=None):
+    """Parse ids from a file (whitespace separated) or a comma separated list, checking
+    that they are within a corpus of count lines if count is given"""
+    if os.path.isfile(text):
+        with open(text, 'r') as f:
+            text = f.read()
+    ids = [int(k) for k in text.replace(',', ' ').split()]
+    if count is not None:
+        invalid = [k for k in ids if not -count <= k < count]
+        if invalid:
+            shown = ', '.join(str(k) for k in invalid[:5]) + (', ...' if len(invalid) > 5 else '')
+            raise ValueError(f'ids outside of the {count} samples: {shown}')
+    return ids
@@ -1,37 +1,456 @@
 # cython: language_level=3, boundscheck=False, wraparound=False
-from numpy import int32
-from numpy cimport ndarray
+from libc.stdint cimport int32_t, uint8_t, uint16_t, uint32_t, uint64_t
+from libc.stdlib cimport calloc, malloc, realloc, free
+from libc.string cimport memcpy, memset
+from cpython.mem cimport PyMem_Free
+from cpython.pythread cimport PyThread_get_thread_ident
+from cpython.unicode cimport (
+    PyUnicode_AsUCS4Copy, PyUnicode_KIND, PyUnicode_1BYTE_KIND, PyUnicode_2BYTE_KIND,
+    PyUnicode_1BYTE_DATA, PyUnicode_2BYTE_DATA, PyUnicode_4BYTE_DATA)
+from cython.parallel cimport prange, threadid
+import os
+import threading
+from collections import namedtuple
+from . import profiling
 
 
 cdef str op_delete = 'delete'
 cdef str op_insert = 'insert'
 cdef str op_replace = 'replace'
+cdef tuple op_names = (op_delete, op_insert, op_replace)
 
+# largest cost matrix (in cells) editops allocates before switching to linear space
+LINEAR_SPACE_THRESHOLD = 1 << 24
 
-cdef int [:, :] cost_matrix_c(str s, str t, int m, int n, int substitution_cost):
-    """Compute the cost matrix to transform string s into string t"""
-    cdef int i, j, x
-    cdef int [:, :] cost = ndarray((m + 1, n + 1), dtype=int32)
-    cost[0, 0] = 0
-    for i in range(1, m + 1):
-        cost[i, 0] = i
-    for j in range(1, n + 1):
-        cost[0, j] = j
+# character/word edit distances of a pair along with its reference lengths
+ErrorCounts = namedtuple('ErrorCounts', ('char_edits', 'word_edits', 'ref_chars', 'ref_words'),
+                         module=__name__)
+
+
+cdef enum:
+    OP_DELETE = 0
+    OP_INSERT = 1
+    OP_REPLACE = 2
+
+
+cdef enum:
+    # negative status codes returned by the nogil computations
+    FAILED_ALLOCATION = -1
+    EXCEEDED_MAX_DISTANCE = -2
+
+
+# the sequences compared are code points or (for words) token ids, which can exceed
+# the largest code point so are not stored as Py_UCS4
+ctypedef uint32_t symbol
+
+
+ctypedef struct edit_op:
+    int op
+    Py_ssize_t spos
+    Py_ssize_t dpos
+
+
+ctypedef struct scratch:
+    char *data
+    size_t size
+
+
+ctypedef struct workspace:
+    # grow-only buffers reused from one pair to the next
+    scratch cells  # cost matrix (or its diagonal band) of the current (sub)problem
+    scratch rows   # bit-vectors or rows of the cost matrix
+    scratch ops    # edit operations decoded so far
+
+
+cdef char *scratch_reserve(scratch *sc, size_t size) noexcept nogil:
+    """Grow sc to hold at least size bytes, preserving its contents
+    (returns NULL if allocation fails)"""
+    cdef char *data
+    if size > sc.size or sc.data == NULL:
+        if size < 2 * sc.size:
+            size = 2 * sc.size
+        if size < 64:
+            size = 64
+        data = <char *>realloc(sc.data, size)
+        if data == NULL:
+            return NULL
+        sc.data = data
+        sc.size = size
+    return sc.data
+
+
+cdef void workspace_free(workspace *ws) noexcept nogil:
+    free(ws.cells.data)
+    free(ws.rows.data)
+    free(ws.ops.data)
+    memset(ws, 0, sizeof(workspace))
+
+
+# largest scratch buffer (in bytes) an arena keeps from one call to the next
+cdef size_t ARENA_LIMIT = 1 << 24
+
+
+cdef inline void scratch_trim(scratch *sc, size_t limit) noexcept nogil:
+    """Free the buffer of sc if it has grown beyond limit bytes"""
+    if sc.size > limit:
+        free(sc.data)
+        sc.data = NULL
+        sc.size = 0
+
+
+cdef class Arena:
+    """The scratch buffers of a thread (decoded code points and a workspace), reused
+    by its calls so that scoring a pair allocates nothing once they have grown"""
+    cdef scratch text
+    cdef workspace ws
+
+    def __cinit__(self):
+        memset(&self.text, 0, sizeof(scratch))
+        memset(&self.ws, 0, sizeof(workspace))
+
+    def __dealloc__(self):
+        free(self.text.data)
+        workspace_free(&self.ws)
+
+    cdef symbol *decode(self, str s, str t) except NULL:
+        """Decode s followed by t into the code point buffer"""
+        cdef Py_ssize_t m = len(s)
+        cdef symbol *buffer = <symbol *>scratch_reserve(
+            &self.text, (m + len(t) + 1) * sizeof(symbol))
+        if buffer == NULL:
+            raise MemoryError()
+        decode_into(s, buffer)
+        decode_into(t, buffer + m)
+        return buffer
+
+    cdef void release(self) noexcept:
+        """Free the buffers grown beyond ARENA_LIMIT (e.g. by a pair of long strings)"""
+        scratch_trim(&self.text, ARENA_LIMIT)
+        scratch_trim(&self.ws.cells, ARENA_LIMIT)
+        scratch_trim(&self.ws.rows, ARENA_LIMIT)
+        scratch_trim(&self.ws.ops, ARENA_LIMIT)
+
+
+_arenas = threading.local()
+
+# the arena of the thread which last asked for one (skipping the thread local lookup)
+cdef Arena last_arena = None
+cdef unsigned long last_thread = 0
+
+
+cdef Arena thread_arena():
+    """The arena of the calling thread"""
+    global last_arena, last_thread
+    cdef unsigned long thread = PyThread_get_thread_ident()
+    if last_arena is not None and thread == last_thread:
+        return last_arena
+    arena = getattr(_arenas, 'arena', None)
+    if arena is None:
+        arena = _arenas.arena = Arena()
+    last_arena, last_thread = arena, thread
+    return arena
+
+
+ctypedef struct block_masks:
+    # per 64 symbol block of the pattern, an open addressing table of 128 slots
+    # mapping symbols (keys) to the bit-vector of pattern positions where they occur
+    Py_ssize_t words
+    symbol *keys
+    uint64_t *masks
+    # 2 * words scratch bit-vectors for the blocked recurrence
+    uint64_t *vectors
+
+
+cdef inline uint64_t block_mask(const block_masks *pm, Py_ssize_t w, symbol c) noexcept nogil:
+    """Lookup the match bit-vector of symbol c within block w of the pattern"""
+    cdef Py_ssize_t base = w * 128
+    cdef Py_ssize_t k = (<Py_ssize_t>c) & 127
+    while pm.masks[base + k] and pm.keys[base + k] != c:
+        k = (k + 1) & 127
+    return pm.masks[base + k]
+
+
+cdef int block_masks_init(block_masks *pm, const symbol *s, Py_ssize_t m,
+                          scratch *sc) noexcept nogil:
+    """Compute the match bit-vectors of pattern s within sc
+    (returns -1 if allocation fails)"""
+    cdef Py_ssize_t i, k, base
+    cdef char *data
+    pm.words = (m + 63) // 64
+    data = scratch_reserve(sc, pm.words * (130 * sizeof(uint64_t) + 128 * sizeof(symbol)))
+    if data == NULL:
+        return -1
+    pm.masks = <uint64_t *>data
+    pm.vectors = pm.masks + 128 * pm.words
+    pm.keys = <symbol *>(pm.vectors + 2 * pm.words)
+    # a zero mask marks an empty slot so the keys need no initialization
+    memset(pm.masks, 0, 128 * pm.words * sizeof(uint64_t))
+    for i in range(m):
+        base = (i // 64) * 128
+        k = (<Py_ssize_t>s[i]) & 127
+        while pm.masks[base + k] and pm.keys[base + k] != s[i]:
+            k = (k + 1) & 127
+        pm.keys[base + k] = s[i]
+        pm.masks[base + k] |= (<uint64_t>1) << (i % 64)
+    return 0
+
+
+cdef Py_ssize_t bitparallel_single(const block_masks *pm, Py_ssize_t m,
+                                   const symbol *t, Py_ssize_t n, Py_ssize_t k) noexcept nogil:
+    """Myers/Hyyrö bit-parallel unit cost edit distance for patterns of at most 64 symbols
+    (stopping early with k + 1 once the distance must exceed k >= 0)"""
+    cdef uint64_t vp = ~(<uint64_t>0)
+    cdef uint64_t vn = 0
+    cdef uint64_t last = (<uint64_t>1) << (m - 1)
+    cdef uint64_t x, d0, hp, hn
+    cdef Py_ssize_t j, d = m
+    for j in range(n):
+        x = block_mask(pm, 0, t[j])
+        d0 = (((x & vp) + vp) ^ vp) | x | vn
+        hp = vn | ~(d0 | vp)
+        hn = d0 & vp
+        if hp & last:
+            d += 1
+        elif hn & last:
+            d -= 1
+        hp = (hp << 1) | 1
+        hn = hn << 1
+        vp = hn | ~(d0 | hp)
+        vn = hp & d0
+        if k >= 0 and d - (n - j - 1) > k:
+            return k + 1
+    return d
+
+
+cdef Py_ssize_t bitparallel_blocked(const block_masks *pm, Py_ssize_t m,
+                                    const symbol *t, Py_ssize_t n, Py_ssize_t k) noexcept nogil:
+    """Hyyrö blocked bit-parallel unit cost edit distance for patterns of any length
+    (stopping early as above)"""
+    cdef uint64_t last = (<uint64_t>1) << ((m - 1) % 64)
+    cdef uint64_t x, d0, hp, hn, hp_carry, hn_carry, hp_in, hn_in
+    cdef Py_ssize_t j, w, d = m
+    cdef Py_ssize_t words = pm.words
+    cdef uint64_t *vp = pm.vectors
+    cdef uint64_t *vn = pm.vectors + words
+    for w in range(words):
+        vp[w] = ~(<uint64_t>0)
+        vn[w] = 0
+    for j in range(n):
+        # the top row of the cost matrix increases by one along t
+        hp_carry, hn_carry = 1, 0
+        for w in range(words):
+            x = block_mask(pm, w, t[j]) | hn_carry
+            d0 = (((x & vp[w]) + vp[w]) ^ vp[w]) | x | vn[w]
+            hp = vn[w] | ~(d0 | vp[w])
+            hn = d0 & vp[w]
+            hp_in, hn_in = hp_carry, hn_carry
+            if w < words - 1:
+                hp_carry, hn_carry = hp >> 63, hn >> 63
+            else:
+                hp_carry, hn_carry = (hp & last) != 0, (hn & last) != 0
+            hp = (hp << 1) | hp_in
+            hn = (hn << 1) | hn_in
+            vp[w] = hn | ~(d0 | hp)
+            vn[w] = hp & d0
+        d += hp_carry
+        d -= hn_carry
+        if k >= 0 and d - (n - j - 1) > k:
+            return k + 1
+    return d
+
+
+cdef Py_ssize_t bitparallel_c(const symbol *s, Py_ssize_t m,
+                              const symbol *t, Py_ssize_t n, Py_ssize_t k,
+                              scratch *sc) noexcept nogil:
+    """Compute the unit cost edit distance between code point arrays s and t
+    where 0 < m <= n (returns -1 if allocation fails)"""
+    cdef block_masks pm
+    # the shorter sequence is encoded as bit-vectors
+    if block_masks_init(&pm, s, m, sc) < 0:
+        return FAILED_ALLOCATION
+    if pm.words == 1:
+        return bitparallel_single(&pm, m, t, n, k)
+    return bitparallel_blocked(&pm, m, t, n, k)
+
+
+cdef Py_ssize_t tworow_c(const symbol *s, Py_ssize_t m,
+                         const symbol *t, Py_ssize_t n, int substitution_cost,
+                         scratch *sc) noexcept nogil:
+    """Compute the edit distance between code point arrays s and t keeping only
+    two columns of the cost matrix, where 0 < m <= n (returns -1 if allocation fails)"""
+    cdef Py_ssize_t i, j, x, c
+    cdef Py_ssize_t *rows = <Py_ssize_t *>scratch_reserve(sc, 2 * (m + 1) * sizeof(Py_ssize_t))
+    cdef Py_ssize_t *prev = rows
+    cdef Py_ssize_t *curr = rows + m + 1
+    if rows == NULL:
+        return FAILED_ALLOCATION
+    for i in range(m + 1):
+        prev[i] = i
     for j in range(1, n + 1):
+        curr[0] = j
         for i in range(1, m + 1):
-            x = 0 if s[i - 1] == t[j - 1] else substitution_cost
-            cost[i, j] = min(cost[i - 1, j]     + 1,
-                             cost[i, j - 1]     + 1,
-                             cost[i - 1, j - 1] + x)
-    return cost
+            x = prev[i - 1] + (0 if s[i - 1] == t[j - 1] else substitution_cost)
+            c = (prev[i] if prev[i] < curr[i - 1] else curr[i - 1]) + 1
+            curr[i] = c if c < x else x
+        prev, curr = curr, prev
+    return prev[m]
+
+
+cdef Py_ssize_t banded_c(const symbol *s, Py_ssize_t m,
+                         const symbol *t, Py_ssize_t n, int substitution_cost,
+                         Py_ssize_t k, scratch *sc) noexcept nogil:
+    """Compute the edit distance between code point arrays s and t, where 0 < m <= n,
+    restricted to the diagonal band |i - j| <= k of the cost matrix (Ukkonen), and
+    stopping early with k + 1 once the distance must exceed k (returns -1 if
+    allocation fails)"""
+    cdef Py_ssize_t i, j, x, c, lo, hi, least
+    cdef Py_ssize_t exceeded = k + 1
+    cdef Py_ssize_t *rows = <Py_ssize_t *>scratch_reserve(sc, 2 * (m + 1) * sizeof(Py_ssize_t))
+    cdef Py_ssize_t *prev = rows
+    cdef Py_ssize_t *curr = rows + m + 1
+    if rows == NULL:
+        return FAILED_ALLOCATION
+    for i in range(m + 1):
+        prev[i] = i if i <= k else exceeded
+    for j in range(1, n + 1):
+        lo = j - k if j > k else 0
+        hi = j + k if j + k < m else m
+        # cells just outside the band read as exceeding k
+        if lo == 0:
+            curr[0] = j
+            least = j
+            lo = 1
+        else:
+            curr[lo - 1] = exceeded
+            least = exceeded
+        if hi < m:
+            curr[hi + 1] = exceeded
+        for i in range(lo, hi + 1):
+            x = prev[i - 1] + (0 if s[i - 1] == t[j - 1] else substitution_cost)
+            c = (prev[i] if prev[i] < curr[i - 1] else curr[i - 1]) + 1
+            c = c if c < x else x
+            curr[i] = c if c < exceeded else exceeded
+            if curr[i] < least:
+                least = curr[i]
+        # every path crosses this column so none can cost at most k
+        if least > k:
+            return exceeded
+        prev, curr = curr, prev
+    return prev[m]
+
+
+cdef Py_ssize_t distance_c(const symbol *s, Py_ssize_t m,
+                           const symbol *t, Py_ssize_t n, int substitution_cost,
+                           Py_ssize_t max_distance, workspace *ws) noexcept nogil:
+    """Compute the edit distance between code point arrays s and t in memory linear
+    in the shorter of the two, or max_distance + 1 if max_distance >= 0 and the
+    distance exceeds it (returns -1 if allocation fails)"""
+    cdef Py_ssize_t d
+    # remove common prefix/suffix of s and t
+    while m > 0 and n > 0 and s[0] == t[0]:
+        s += 1
+        t += 1
+        m -= 1
+        n -= 1
+    while m > 0 and n > 0 and s[m - 1] == t[n - 1]:
+        m -= 1
+        n -= 1
+    # the cost is symmetric so the shorter sequence can always index the rows
+    if m > n:
+        s, t = t, s
+        m, n = n, m
+    if max_distance >= 0 and n - m > max_distance:
+        return max_distance + 1
+    if m == 0:
+        return n
+    # the band is cheaper than the bit-vectors only when it is narrow relative to m
+    if substitution_cost == 1 and (max_distance < 0 or m <= 64 or max_distance > m // 64):
+        d = bitparallel_c(s, m, t, n, max_distance, &ws.rows)
+    elif max_distance >= 0:
+        d = banded_c(s, m, t, n, substitution_cost, max_distance, &ws.rows)
+    else:
+        d = tworow_c(s, m, t, n, substitution_cost, &ws.rows)
+    if max_distance >= 0 and d > max_distance:
+        return max_distance + 1
+    return d
 
 
-cdef list editops_c(str s, str t, int substitution_cost):
-    """Compute an optimal set of edit operations to transform string s into string t"""
+cdef inline void cost_row_c(symbol c, const symbol *t, Py_ssize_t n, int substitution_cost,
+                            const int *above, int *row) noexcept nogil:
+    """Compute a row of the cost matrix (the costs of transforming s[:i] into each
+    prefix of t) from the row above it, where c is s[i - 1]"""
+    cdef Py_ssize_t j
+    cdef int x, y
+    row[0] = above[0] + 1
+    for j in range(1, n + 1):
+        x = above[j - 1] + (0 if c == t[j - 1] else substitution_cost)
+        y = min(above[j], row[j - 1]) + 1
+        row[j] = y if y < x else x
+
+
+cdef void cost_matrix_c(const symbol *s, const symbol *t, Py_ssize_t m, Py_ssize_t n,
+                        int substitution_cost, int *cost) noexcept nogil:
+    """Compute the cost matrix (by row, with n + 1 columns) to transform code point
+    array s into code point array t"""
+    cdef Py_ssize_t i, j, w = n + 1
+    for j in range(n + 1):
+        cost[j] = j
+    for i in range(1, m + 1):
+        cost_row_c(s[i - 1], t, n, substitution_cost, cost + (i - 1) * w, cost + i * w)
+
+
+cdef inline int band_cell(const int *d, Py_ssize_t w, Py_ssize_t k,
+                          Py_ssize_t i, Py_ssize_t j) noexcept nogil:
+    """Read cell (i, j) of a cost matrix stored in full by row (k < 0) or as its
+    diagonal band |i - j| <= k by column (cells outside of the band read as k + 1),
+    where w is the stride of the storage"""
+    if k < 0:
+        return d[i * w + j]
+    if i < j - k or i > j + k:
+        return k + 1
+    return d[j * w + i - (j - k if j > k else 0)]
+
+
+cdef int band_matrix_c(const symbol *s, const symbol *t, Py_ssize_t m, Py_ssize_t n,
+                       int substitution_cost, Py_ssize_t k, Py_ssize_t w, int *cost) noexcept nogil:
+    """Compute the diagonal band |i - j| <= k of the cost matrix to transform code point
+    array s into code point array t, stored by column with stride w (returns -2 if no
+    path within the band costs at most k)"""
+    cdef Py_ssize_t i, j, lo, hi
+    cdef int x, c, least
+    for j in range(n + 1):
+        lo = j - k if j > k else 0
+        hi = j + k if j + k < m else m
+        least = k + 1
+        for i in range(lo, hi + 1):
+            if i == 0 or j == 0:
+                c = i + j
+            else:
+                x = band_cell(cost, w, k, i - 1, j - 1) + (0 if s[i - 1] == t[j - 1] else substitution_cost)
+                c = min(band_cell(cost, w, k, i - 1, j) + 1, band_cell(cost, w, k, i, j - 1) + 1, x)
+            c = c if c <= k else k + 1
+            cost[j * w + i - lo] = c
+            if c < least:
+                least = c
+        if least > k:
+            return EXCEEDED_MAX_DISTANCE
+    return 0
+
+
+cdef Py_ssize_t matrix_editops_c(const symbol *s, Py_ssize_t m, const symbol *t, Py_ssize_t n,
+                                 int substitution_cost, Py_ssize_t spos, Py_ssize_t dpos,
+                                 Py_ssize_t max_distance, workspace *ws,
+                                 Py_ssize_t count) noexcept nogil:
+    """Compute an optimal set of edit operations to transform code point array s into
+    code point array t by decoding the cost matrix (positions offset by spos/dpos),
+    only the diagonal band of which is computed when bounded by max_distance >= 0
+
+    The edit operations are stored in ws.ops following the first count operations,
+    returning the new count of operations (or a negative status code)"""
     # remove common prefix/suffix of s and t resulting in u and v
-    cdef int i = len(s)
-    cdef int j = len(t)
-    cdef int offset = 0
+    cdef Py_ssize_t i = m
+    cdef Py_ssize_t j = n
+    cdef Py_ssize_t offset = 0
     while (i > 0 and j > 0 and s[offset] == t[offset]):
         i -= 1
         j -= 1
@@ -39,64 +458,774 @@ cdef list editops_c(str s, str t, int substitution_cost):
     while (i > 0 and j > 0 and s[i - 1 + offset] == t[j - 1 + offset]):
         i -= 1
         j -= 1
-    cdef str u = s[offset:offset + i]
-    cdef str v = t[offset:offset + j]
-    # compute the cost matrix of transforming u to v
-    cdef int [:, :] d = cost_matrix_c(u, v, i, j, substitution_cost)
-    # decode the cost matrix into an optimal set of edit operations
+    cdef const symbol *u = s + offset
+    cdef const symbol *v = t + offset
+    cdef Py_ssize_t soffset = spos + offset
+    cdef Py_ssize_t doffset = dpos + offset
+    cdef Py_ssize_t band = -1
+    cdef Py_ssize_t w = j + 1
+    cdef int *d
+    cdef edit_op *ops
+    if max_distance >= 0 and (j - i if j > i else i - j) > max_distance:
+        return EXCEEDED_MAX_DISTANCE
+    if 0 <= max_distance < (i if i > j else j):
+        band = max_distance
+        w = (i if i < 2 * band else 2 * band) + 1
+    d = <int *>scratch_reserve(&ws.cells, (i + 1 if band < 0 else j + 1) * w * sizeof(int))
+    if d == NULL:
+        return FAILED_ALLOCATION
+    ops = <edit_op *>scratch_reserve(&ws.ops, (count + i + j) * sizeof(edit_op))
+    if ops == NULL:
+        return FAILED_ALLOCATION
+    # compute the cost matrix (or its diagonal band) of transforming u to v
+    if band >= 0:
+        if band_matrix_c(u, v, i, j, substitution_cost, band, w, d) < 0:
+            return EXCEEDED_MAX_DISTANCE
+    else:
+        cost_matrix_c(u, v, i, j, substitution_cost, d)
+    if max_distance >= 0 and band_cell(d, w, band, i, j) > max_distance:
+        return EXCEEDED_MAX_DISTANCE
+    return decode_editops_c(u, i, v, j, d, w, band, substitution_cost,
+                            soffset, doffset, ops, count)
+
+
+cdef Py_ssize_t decode_editops_c(const symbol *u, Py_ssize_t i, const symbol *v, Py_ssize_t j,
+                                 const int *d, Py_ssize_t w, Py_ssize_t band,
+                                 int substitution_cost, Py_ssize_t soffset, Py_ssize_t doffset,
+                                 edit_op *ops, Py_ssize_t count) noexcept nogil:
+    """Decode the cost matrix d (stored as read by band_cell) of transforming u[:i]
+    into v[:j] into an optimal set of edit operations (positions offset by soffset/doffset),
+    stored in ops (with room for i + j more) following the first count operations,
+    returning the new count of operations"""
+    # decode the cost matrix into an optimal set of edit operations (in reverse)
     cdef int k = 0
-    cdef list ops = []
-    while i > 0 or j > 0:        
-        if k < 0 and j > 0 and d[i, j] == d[i, j - 1] + 1:
+    cdef int op
+    cdef Py_ssize_t first = count
+    cdef edit_op swap
+    while i > 0 or j > 0:
+        op = -1
+        if k < 0 and j > 0 and band_cell(d, w, band, i, j) == band_cell(d, w, band, i, j - 1) + 1:
             j -= 1
             k = -1
-            ops.append((op_insert, i + offset, j + offset))
-        elif k > 0 and i > 0 and d[i, j] == d[i - 1, j] + 1:
+            op = OP_INSERT
+        elif k > 0 and i > 0 and band_cell(d, w, band, i, j) == band_cell(d, w, band, i - 1, j) + 1:
             i -= 1
             k = 1
-            ops.append((op_delete, i + offset, j + offset))
-        elif i > 0 and j > 0 and u[i - 1] == v[j - 1] and d[i, j] == d[i - 1, j - 1]:
+            op = OP_DELETE
+        elif i > 0 and j > 0 and u[i - 1] == v[j - 1] and band_cell(d, w, band, i, j) == band_cell(d, w, band, i - 1, j - 1):
             i -= 1
             j -= 1
             k = 0
-        elif i > 0 and j > 0 and d[i, j] == d[i - 1, j - 1] + substitution_cost:
+        elif i > 0 and j > 0 and band_cell(d, w, band, i, j) == band_cell(d, w, band, i - 1, j - 1) + substitution_cost:
             i -= 1
             j -= 1
             k = 0
-            ops.append((op_replace, i + offset, j + offset))
-        elif j > 0 and d[i, j] == d[i, j - 1] + 1:
+            op = OP_REPLACE
+        elif j > 0 and band_cell(d, w, band, i, j) == band_cell(d, w, band, i, j - 1) + 1:
             j -= 1
             k = -1
-            ops.append((op_insert, i + offset, j + offset))
-        elif i > 0 and d[i, j] == d[i - 1, j] + 1:
+            op = OP_INSERT
+        elif i > 0 and band_cell(d, w, band, i, j) == band_cell(d, w, band, i - 1, j) + 1:
             i -= 1
             k = 1
-            ops.append((op_delete, i + offset, j + offset))
-    ops.reverse()
-    return ops
+            op = OP_DELETE
+        if op >= 0:
+            ops[count].op = op
+            ops[count].spos = i + soffset
+            ops[count].dpos = j + doffset
+            count += 1
+    # restore the order of the newly decoded edit operations
+    i, j = first, count - 1
+    while i < j:
+        swap = ops[i]
+        ops[i] = ops[j]
+        ops[j] = swap
+        i += 1
+        j -= 1
+    return count
+
 
+cdef void last_row_c(const symbol *s, Py_ssize_t m, const symbol *t, Py_ssize_t n,
+                     int substitution_cost, bint reverse, Py_ssize_t k,
+                     Py_ssize_t *row) noexcept nogil:
+    """Compute the last row of the cost matrix to transform s into t (or the reversal of
+    s into the reversal of t), such that row[j] is the cost of transforming s into t[:j],
+    restricted to the diagonal band |i - j| <= k when k >= 0 (cells outside of the band
+    read as k + 1)"""
+    cdef Py_ssize_t i, j, x, c, diagonal, above, lo, hi
+    cdef symbol a
+    if k < 0:
+        # no cost exceeds deleting all of s and inserting all of t
+        k = m + n
+    for j in range(n + 1):
+        row[j] = j if j <= k else k + 1
+    for i in range(1, m + 1):
+        a = s[m - i] if reverse else s[i - 1]
+        lo = i - k if i > k else 1
+        hi = i + k if i + k < n else n
+        if lo > n + 1:
+            # the rest of the rows lie entirely outside of the band
+            break
+        # the cell left of the band (which the band has just left, or the first column)
+        diagonal = row[lo - 1]
+        row[lo - 1] = i if lo == 1 else k + 1
+        for j in range(lo, hi + 1):
+            above = row[j]
+            x = diagonal + (0 if a == (t[n - j] if reverse else t[j - 1]) else substitution_cost)
+            c = (above if above < row[j - 1] else row[j - 1]) + 1
+            c = c if c < x else x
+            row[j] = c if c <= k else k + 1
+            diagonal = above
+
+
+cdef Py_ssize_t hirschberg_c(const symbol *s, Py_ssize_t m, const symbol *t, Py_ssize_t n,
+                             int substitution_cost, Py_ssize_t spos, Py_ssize_t dpos,
+                             Py_ssize_t threshold, Py_ssize_t max_distance,
+                             Py_ssize_t *forward, Py_ssize_t *backward,
+                             workspace *ws, Py_ssize_t count) noexcept nogil:
+    """Divide and conquer (Hirschberg) computation of an optimal set of edit operations,
+    splitting s in half until the cost matrix of a subproblem has at most threshold cells
+    (forward and backward are scratch rows of at least n + 1 elements)
+
+    When max_distance >= 0 is at least the edit distance, the computation is restricted
+    to the diagonal band |i - j| <= max_distance holding every path within that cost,
+    and each subproblem to the band of the cost of its part of the optimal path"""
+    cdef Py_ssize_t j, split, mid = m // 2
+    cdef Py_ssize_t head = -1, tail = -1
+    cdef Py_ssize_t cells = (m + 1) * (n + 1)
+    if 0 <= max_distance < m // 2:
+        cells = (2 * max_distance + 1) * (n + 1)
+    if m < 2 or n < 2 or cells <= threshold:
+        return matrix_editops_c(s, m, t, n, substitution_cost, spos, dpos,
+                                max_distance, ws, count)
+    # find where an optimal path crosses the middle row of the cost matrix
+    last_row_c(s, mid, t, n, substitution_cost, False, max_distance, forward)
+    last_row_c(s + mid, m - mid, t, n, substitution_cost, True, max_distance, backward)
+    split = 0
+    for j in range(1, n + 1):
+        if forward[j] + backward[n - j] < forward[split] + backward[n - split]:
+            split = j
+    if max_distance >= 0:
+        # the costs of the two halves of the optimal path bound their subproblems
+        head, tail = forward[split], backward[n - split]
+    count = hirschberg_c(s, mid, t, split, substitution_cost, spos, dpos,
+                         threshold, head, forward, backward, ws, count)
+    if count < 0:
+        return count
+    return hirschberg_c(s + mid, m - mid, t + split, n - split, substitution_cost,
+                        spos + mid, dpos + split, threshold, tail,
+                        forward, backward, ws, count)
+
+
+cdef Py_ssize_t editops_c(const symbol *s, Py_ssize_t m, const symbol *t, Py_ssize_t n,
+                          int substitution_cost, Py_ssize_t linear_space_threshold,
+                          Py_ssize_t max_distance, workspace *ws, Py_ssize_t count) noexcept nogil:
+    """Compute an optimal set of edit operations to transform code point array s into
+    code point array t, in linear space when the cost matrix (or its diagonal band when
+    bounded by max_distance >= 0) exceeds the threshold
+
+    When bounded, a pair whose edit distance exceeds max_distance is rejected by the
+    (early exiting) distance computation before any edit operations are computed, and
+    otherwise only the diagonal band of each subproblem is computed in linear space.
+
+    The edit operations are stored in ws.ops following the first count operations,
+    returning the new count of operations (or a negative status code)"""
+    cdef Py_ssize_t *rows
+    cdef Py_ssize_t d, cells = (m + 1) * (n + 1)
+    if 0 <= max_distance < m // 2:
+        cells = (2 * max_distance + 1) * (n + 1)
+    if cells <= linear_space_threshold:
+        return matrix_editops_c(s, m, t, n, substitution_cost, 0, 0, max_distance, ws, count)
+    if max_distance >= 0:
+        d = distance_c(s, m, t, n, substitution_cost, max_distance, ws)
+        if d < 0:
+            return d
+        if d > max_distance:
+            return EXCEEDED_MAX_DISTANCE
+        # the band need only hold the optimal paths
+        max_distance = d
+    rows = <Py_ssize_t *>scratch_reserve(&ws.rows, 2 * (n + 1) * sizeof(Py_ssize_t))
+    if rows == NULL:
+        return FAILED_ALLOCATION
+    return hirschberg_c(s, m, t, n, substitution_cost, 0, 0, linear_space_threshold,
+                        max_distance, rows, rows + n + 1, ws, count)
+
+
+cdef list ops_list(const edit_op *ops, Py_ssize_t start, Py_ssize_t stop):
+    """Convert decoded edit operations into (op, spos, dpos) tuples"""
+    cdef Py_ssize_t x
+    return [(op_names[ops[x].op], ops[x].spos, ops[x].dpos) for x in range(start, stop)]
+
+
+cdef inline void decode_into(str u, symbol *buffer):
+    """Copy the code points of u into buffer"""
+    cdef Py_ssize_t i, n = len(u)
+    cdef int kind = PyUnicode_KIND(u)
+    cdef uint8_t *ucs1
+    cdef uint16_t *ucs2
+    if kind == PyUnicode_1BYTE_KIND:
+        ucs1 = <uint8_t *>PyUnicode_1BYTE_DATA(u)
+        for i in range(n):
+            buffer[i] = ucs1[i]
+    elif kind == PyUnicode_2BYTE_KIND:
+        ucs2 = <uint16_t *>PyUnicode_2BYTE_DATA(u)
+        for i in range(n):
+            buffer[i] = ucs2[i]
+    else:
+        memcpy(buffer, PyUnicode_4BYTE_DATA(u), n * sizeof(symbol))
+
+
+cpdef editops(str s, str t, int substitution_cost=1,
+              Py_ssize_t linear_space_threshold=LINEAR_SPACE_THRESHOLD,
+              Py_ssize_t max_distance=-1):
+    """Exposed python wrapper for editops_c (linear_space_threshold is the largest
+    number of cost matrix cells to allocate before switching to Hirschberg's algorithm,
+    and when max_distance >= 0 only a diagonal band of the cost matrix is computed and
+    None is returned if the edit distance exceeds max_distance)"""
+    cdef Arena arena = thread_arena()
+    cdef Py_ssize_t count, m = len(s)
+    cdef symbol *a
+    profile = profiling.current
+    if profile is not None:
+        start = profiling.clock()
+    a = arena.decode(s, t)
+    try:
+        count = editops_c(a, m, a + m, len(t), substitution_cost,
+                          linear_space_threshold, max_distance, &arena.ws, 0)
+        if count == FAILED_ALLOCATION:
+            raise MemoryError()
+        if count == EXCEEDED_MAX_DISTANCE:
+            return None
+        return ops_list(<edit_op *>arena.ws.ops.data, 0, count)
+    finally:
+        arena.release()
+        if profile is not None:
+            profile.lap('editops', start)
+
+
+cpdef editdistance(str s, str t, int substitution_cost=1, Py_ssize_t max_distance=-1):
+    """Exposed python wrapper to compute edit distance without a full cost matrix
+    (bit-parallel for unit costs, otherwise two columns of the cost matrix), where
+    max_distance >= 0 restricts the computation to a diagonal band of the cost matrix
+    and max_distance + 1 is returned as soon as the distance must exceed it"""
+    cdef Arena arena = thread_arena()
+    cdef Py_ssize_t d, m = len(s)
+    cdef symbol *a
+    profile = profiling.current
+    if profile is not None:
+        start = profiling.clock()
+    a = arena.decode(s, t)
+    d = distance_c(a, m, a + m, len(t), substitution_cost, max_distance, &arena.ws)
+    arena.release()
+    if profile is not None:
+        profile.lap('editdistance', start)
+    if d < 0:
+        raise MemoryError()
+    return d
+
+
+cpdef editops_ids(const int32_t [::1] s, const int32_t [::1] t, int substitution_cost=1,
+                  Py_ssize_t linear_space_threshold=LINEAR_SPACE_THRESHOLD,
+                  Py_ssize_t max_distance=-1):
+    """editops of two sequences of integer token ids (any int32 buffer, e.g. the
+    arrays of a Vocabulary), skipping the encoding of tokens as strings"""
+    cdef Arena arena = thread_arena()
+    cdef Py_ssize_t count
+    profile = profiling.current
+    if profile is not None:
+        start = profiling.clock()
+    try:
+        count = editops_c(<const symbol *>&s[0], s.shape[0], <const symbol *>&t[0], t.shape[0],
+                          substitution_cost, linear_space_threshold, max_distance, &arena.ws, 0)
+        if count == FAILED_ALLOCATION:
+            raise MemoryError()
+        if count == EXCEEDED_MAX_DISTANCE:
+            return None
+        return ops_list(<edit_op *>arena.ws.ops.data, 0, count)
+    finally:
+        arena.release()
+        if profile is not None:
+            profile.lap('editops', start)
+
+
+cpdef editdistance_ids(const int32_t [::1] s, const int32_t [::1] t, int substitution_cost=1,
+                       Py_ssize_t max_distance=-1):
+    """editdistance of two sequences of integer token ids (any int32 buffer, e.g. the
+    arrays of a Vocabulary), skipping the encoding of tokens as strings"""
+    cdef Arena arena = thread_arena()
+    cdef Py_ssize_t d
+    profile = profiling.current
+    if profile is not None:
+        start = profiling.clock()
+    d = distance_c(<const symbol *>&s[0], s.shape[0], <const symbol *>&t[0], t.shape[0],
+                   substitution_cost, max_distance, &arena.ws)
+    arena.release()
+    if profile is not None:
+        profile.lap('editdistance', start)
+    if d < 0:
+        raise MemoryError()
+    return d
+
+
+cpdef score_pair(str hyp, str ref):
+    """Compute the character and word edit distances of a pair (as ErrorCounts) in one
+    call, splitting each string into words once (characters exclude whitespace)"""
+    profile = profiling.current
+    if profile is not None:
+        start = profiling.clock()
+    cdef list s_words = hyp.split()
+    cdef list t_words = ref.split()
+    cdef str s_chars = ''.join(s_words)
+    cdef str t_chars = ''.join(t_words)
+    cdef dict ids = {}
+    cdef Py_ssize_t k, char_edits, word_edits
+    cdef Py_ssize_t m = len(s_words), n = len(t_words), mc = len(s_chars), nc = len(t_chars)
+    cdef Arena arena = thread_arena()
+    cdef workspace *ws = &arena.ws
+    # word ids followed by code points of s and then t
+    cdef symbol *buffer = <symbol *>scratch_reserve(
+        &arena.text, (m + n + mc + nc + 1) * sizeof(symbol))
+    if buffer == NULL:
+        raise MemoryError()
+    try:
+        for k in range(m):
+            buffer[k] = <symbol><Py_ssize_t>ids.setdefault(s_words[k], len(ids))
+        for k in range(n):
+            buffer[m + k] = <symbol><Py_ssize_t>ids.setdefault(t_words[k], len(ids))
+        decode_into(s_chars, buffer + m + n)
+        decode_into(t_chars, buffer + m + n + mc)
+        with nogil:
+            char_edits = distance_c(buffer + m + n, mc, buffer + m + n + mc, nc, 1, -1, ws)
+            word_edits = distance_c(buffer, m, buffer + m, n, 1, -1, ws)
+    finally:
+        arena.release()
+    if profile is not None:
+        profile.lap('score_pair', start)
+    if char_edits < 0 or word_edits < 0:
+        raise MemoryError()
+    return ErrorCounts(char_edits, word_edits, nc, n)
+
+
+cdef Py_ssize_t prepared_distance_c(block_masks *pm, Py_ssize_t m,
+                                    const symbol *t, Py_ssize_t n) noexcept nogil:
+    """Compute the unit cost edit distance between a pattern of m symbols (prepared
+    as the match bit-vectors pm) and code point array t"""
+    if m == 0:
+        return n
+    if pm.words == 1:
+        return bitparallel_single(pm, m, t, n, -1)
+    return bitparallel_blocked(pm, m, t, n, -1)
+
+
+cdef class PreparedReference:
+    """A reference split into words (interned as ids) and characters (excluding
+    whitespace) with the match bit-vectors of both computed once, so that many
+    hypotheses (e.g. an N-best list) can be scored against it in one call"""
+    cdef readonly str reference
+    cdef readonly Py_ssize_t n_words
+    cdef readonly Py_ssize_t n_chars
+    cdef dict ids
+    cdef block_masks word_masks
+    cdef block_masks char_masks
+    cdef scratch word_scratch
+    cdef scratch char_scratch
+
+    def __cinit__(self, str reference):
+        cdef list words = reference.split()
+        cdef str chars = ''.join(words)
+        cdef Py_ssize_t k, m = len(words), mc = len(chars)
+        cdef symbol *buffer = <symbol *>malloc((m + mc + 1) * sizeof(symbol))
+        memset(&self.word_scratch, 0, sizeof(scratch))
+        memset(&self.char_scratch, 0, sizeof(scratch))
+        if buffer == NULL:
+            raise MemoryError()
+        self.reference = reference
+        self.n_words, self.n_chars = m, mc
+        self.ids = {}
+        try:
+            for k in range(m):
+                buffer[k] = <symbol><Py_ssize_t>self.ids.setdefault(words[k], len(self.ids))
+            decode_into(chars, buffer + m)
+            if (block_masks_init(&self.word_masks, buffer, m, &self.word_scratch) < 0 or
+                    block_masks_init(&self.char_masks, buffer + m, mc, &self.char_scratch) < 0):
+                raise MemoryError()
+        finally:
+            free(buffer)
+
+    def __dealloc__(self):
+        free(self.word_scratch.data)
+        free(self.char_scratch.data)
+
+    def score(self, hyps):
+        """Compute the character and word edit distances of each hypothesis to the
+        reference (as ErrorCounts, see `score_pair`)"""
+        profile = profiling.current
+        if profile is not None:
+            start = profiling.clock()
+        cdef list words = [hyp.split() for hyp in hyps]
+        cdef list chars = [''.join(w) for w in words]
+        cdef Py_ssize_t count = len(words), k, x, size = 0, unknown = len(self.ids)
+        cdef Py_ssize_t *offsets = <Py_ssize_t *>malloc((3 * count + 1) * sizeof(Py_ssize_t))
+        cdef Py_ssize_t *edits = <Py_ssize_t *>malloc((2 * count + 1) * sizeof(Py_ssize_t))
+        cdef symbol *buffer = NULL
+        cdef symbol *u
+        cdef list hyp_words
+        # the prepared masks are shared (read only) between threads, while each call
+        # has its own scratch bit-vectors for the blocked recurrence
+        cdef block_masks char_masks = self.char_masks, word_masks = self.word_masks
+        cdef uint64_t *vectors = <uint64_t *>malloc(
+            (2 * (char_masks.words + word_masks.words) + 1) * sizeof(uint64_t))
+        if offsets == NULL or edits == NULL or vectors == NULL:
+            free(offsets)
+            free(edits)
+            free(vectors)
+            raise MemoryError()
+        char_masks.vectors = vectors
+        word_masks.vectors = vectors + 2 * char_masks.words
+        try:
+            # the word ids and then the code points of each hypothesis
+            for k in range(count):
+                offsets[3 * k] = size
+                size += len(<list>words[k])
+                offsets[3 * k + 1] = size
+                size += len(<str>chars[k])
+                offsets[3 * k + 2] = size
+            buffer = <symbol *>malloc((size + 1) * sizeof(symbol))
+            if buffer == NULL:
+                raise MemoryError()
+            for k in range(count):
+                hyp_words = words[k]
+                u = buffer + offsets[3 * k]
+                # words missing from the reference share an id as they only ever mismatch
+                for x in range(len(hyp_words)):
+                    u[x] = <symbol><Py_ssize_t>self.ids.get(hyp_words[x], unknown)
+                decode_into(chars[k], buffer + offsets[3 * k + 1])
+            with nogil:
+                for k in range(count):
+                    edits[2 * k] = prepared_distance_c(
+                        &char_masks, self.n_chars, buffer + offsets[3 * k + 1],
+                        offsets[3 * k + 2] - offsets[3 * k + 1])
+                    edits[2 * k + 1] = prepared_distance_c(
+                        &word_masks, self.n_words, buffer + offsets[3 * k],
+                        offsets[3 * k + 1] - offsets[3 * k])
+            return [ErrorCounts(edits[2 * k], edits[2 * k + 1], self.n_chars, self.n_words)
+                    for k in range(count)]
+        finally:
+            free(offsets)
+            free(edits)
+            free(buffer)
+            free(vectors)
+            if profile is not None:
+                profile.lap('prepared_score', start)
+
+
+cdef class IncrementalAligner:
+    """Align a growing hypothesis (e.g. the partial hypotheses of a streaming recognizer)
+    against a fixed reference, keeping a row of the cost matrix per hypothesis token so
+    appending k tokens costs O(k * len(reference)) and retracting tokens is O(1)
+
+    Tokens are the characters of the reference (or its words if word_level). Hypothesis
+    tokens are appended from a string (split into words if word_level) or a sequence of
+    tokens, and the edit distance and operations (as `editops(hypothesis, reference)`)
+    are available after every update."""
+    cdef symbol *reference
+    cdef readonly Py_ssize_t n
+    cdef Py_ssize_t m
+    cdef readonly bint word_level
+    cdef readonly int substitution_cost
+    cdef dict ids
+    cdef scratch tokens  # code points (or word ids) of the hypothesis
+    cdef scratch cost    # rows 0..m of the cost matrix, each with n + 1 cells
+    cdef workspace ws
+
+    def __cinit__(self, reference, bint word_level=False, int substitution_cost=1):
+        cdef Py_ssize_t j
+        cdef int *row
+        memset(&self.ws, 0, sizeof(workspace))
+        memset(&self.tokens, 0, sizeof(scratch))
+        memset(&self.cost, 0, sizeof(scratch))
+        self.word_level = word_level
+        self.substitution_cost = substitution_cost
+        self.ids = {}
+        if isinstance(reference, str):
+            reference = reference.split() if word_level else list(reference)
+        reference = list(reference)
+        self.n = len(reference)
+        self.m = 0
+        self.reference = <symbol *>malloc((self.n + 1) * sizeof(symbol))
+        row = <int *>scratch_reserve(&self.cost, (self.n + 1) * sizeof(int))
+        if self.reference == NULL or row == NULL:
+            raise MemoryError()
+        for j in range(self.n):
+            self.reference[j] = self.token_id(reference[j], True)
+        for j in range(self.n + 1):
+            row[j] = j
+
+    def __dealloc__(self):
+        free(self.reference)
+        free(self.tokens.data)
+        free(self.cost.data)
+        workspace_free(&self.ws)
 
-cpdef editops(str s, str t, int substitution_cost=1):
-    """Exposed python wrapper for editops_c"""
-    return editops_c(s, t, substitution_cost)
+    def __len__(self):
+        return self.m
 
+    cdef symbol token_id(self, token, bint intern) except? 0xFFFFFFFF:
+        """Code point of a character, or id of a word (hypothesis words missing from
+        the reference all share an id, as they only ever mismatch)"""
+        if not self.word_level:
+            return ord(token)
+        if intern:
+            return <symbol><Py_ssize_t>self.ids.setdefault(token, len(self.ids))
+        return <symbol><Py_ssize_t>self.ids.get(token, len(self.ids))
 
-cpdef editdistance(str s, str t, int substitution_cost=1):
+    def extend(self, tokens):
+        """Append tokens to the hypothesis, returning the updated edit distance"""
+        if isinstance(tokens, str):
+            tokens = tokens.split() if self.word_level else list(tokens)
+        tokens = list(tokens)
+        cdef Py_ssize_t k, count = len(tokens), w = self.n + 1
+        cdef symbol *hypothesis = <symbol *>scratch_reserve(
+            &self.tokens, (self.m + count) * sizeof(symbol))
+        cdef int *cost = <int *>scratch_reserve(&self.cost, (self.m + count + 1) * w * sizeof(int))
+        if hypothesis == NULL or cost == NULL:
+            raise MemoryError()
+        for k in range(count):
+            hypothesis[self.m + k] = self.token_id(tokens[k], False)
+        with nogil:
+            for k in range(self.m + 1, self.m + count + 1):
+                cost_row_c(hypothesis[k - 1], self.reference, self.n, self.substitution_cost,
+                           cost + (k - 1) * w, cost + k * w)
+        self.m += count
+        return self.distance
+
+    def retract(self, Py_ssize_t k=1):
+        """Remove the last k tokens of the hypothesis, returning the updated edit distance"""
+        if not 0 <= k <= self.m:
+            raise ValueError(f'cannot retract {k} of {self.m} hypothesis tokens')
+        self.m -= k
+        return self.distance
+
+    @property
+    def distance(self):
+        """Edit distance between the hypothesis and the reference"""
+        return (<int *>self.cost.data)[self.m * (self.n + 1) + self.n]
+
+    def editops(self):
+        """Edit operations transforming the hypothesis into the reference (decoded
+        from the stored cost matrix in O(len(hypothesis) + len(reference)))"""
+        cdef Py_ssize_t count
+        cdef edit_op *ops = <edit_op *>scratch_reserve(&self.ws.ops,
+                                                       (self.m + self.n) * sizeof(edit_op))
+        if ops == NULL:
+            raise MemoryError()
+        with nogil:
+            count = decode_editops_c(<symbol *>self.tokens.data, self.m, self.reference, self.n,
+                                     <int *>self.cost.data, self.n + 1, -1,
+                                     self.substitution_cost, 0, 0, ops, 0)
+        return ops_list(ops, 0, count)
+
+
+cdef class CodePoints:
+    """A batch of strings decoded once into one contiguous buffer of UCS4 code points,
+    where string k occupies offsets[k]:offsets[k + 1] of the buffer"""
+    cdef symbol *buffer
+    cdef Py_ssize_t *offsets
+    cdef readonly Py_ssize_t count
+
+    def __cinit__(self, strings=()):
+        cdef str u
+        cdef Py_ssize_t k, total = 0
+        strings = list(strings)
+        self.count = len(strings)
+        self.offsets = <Py_ssize_t *>malloc((self.count + 1) * sizeof(Py_ssize_t))
+        if self.offsets == NULL:
+            raise MemoryError()
+        self.offsets[0] = 0
+        for k in range(self.count):
+            u = strings[k]
+            total += len(u)
+            self.offsets[k + 1] = total
+        self.buffer = <symbol *>malloc((total + 1) * sizeof(symbol))
+        if self.buffer == NULL:
+            raise MemoryError()
+        for k in range(self.count):
+            decode_into(strings[k], self.buffer + self.offsets[k])
+
+    def __dealloc__(self):
+        free(self.buffer)
+        free(self.offsets)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, Py_ssize_t k):
+        if not 0 <= k < self.count:
+            raise IndexError('code point batch index out of range')
+        return ''.join([chr(self.buffer[i]) for i in range(self.offsets[k], self.offsets[k + 1])])
+
+    @staticmethod
+    def from_buffers(const unsigned int [::1] codepoints, const long long [::1] offsets):
+        """Wrap already decoded code points (uint32) delimited by offsets (int64)"""
+        cdef CodePoints batch = CodePoints()
+        cdef Py_ssize_t k, count = offsets.shape[0] - 1
+        if count < 0 or offsets[0] != 0 or offsets[count] != codepoints.shape[0]:
+            raise ValueError('offsets must start at 0 and end at the number of code points')
+        for k in range(count):
+            if offsets[k + 1] < offsets[k]:
+                raise ValueError('offsets must be non-decreasing')
+        free(batch.buffer)
+        free(batch.offsets)
+        batch.buffer = <symbol *>malloc((codepoints.shape[0] + 1) * sizeof(symbol))
+        batch.offsets = <Py_ssize_t *>malloc((count + 1) * sizeof(Py_ssize_t))
+        if batch.buffer == NULL or batch.offsets == NULL:
+            raise MemoryError()
+        batch.count = count
+        for k in range(codepoints.shape[0]):
+            batch.buffer[k] = codepoints[k]
+        for k in range(count + 1):
+            batch.offsets[k] = offsets[k]
+        return batch
+
+
+cdef CodePoints as_code_points(strings):
+    return strings if isinstance(strings, CodePoints) else CodePoints(strings)
+
+
+cpdef editdistance_batch(hyps, refs, int substitution_cost=1, Py_ssize_t max_distance=-1,
+                         int num_threads=1):
+    """Compute the edit distance of each (hyp, ref) pair as a numpy array, releasing the
+    GIL over the whole batch and reusing one workspace per thread
+
+    hyps and refs are sequences of strings or their pre-decoded CodePoints, and pairs
+    are distributed over num_threads OpenMP threads (all available cores if 0)"""
+    profile = profiling.current
+    if profile is not None:
+        start = profiling.clock()
+    cdef CodePoints a = as_code_points(hyps)
+    cdef CodePoints b = as_code_points(refs)
+    cdef Py_ssize_t p, d, count = a.count
+    if b.count != count:
+        raise ValueError('expected as many references (%d) as hypotheses (%d)' % (b.count, count))
+    if num_threads <= 0:
+        num_threads = os.cpu_count() or 1
+    import numpy
+    distances = numpy.zeros(count, dtype=numpy.intp)
+    cdef Py_ssize_t [::1] out = distances
+    cdef Arena arena = thread_arena()
+    # the calling thread's arena, or a workspace per OpenMP thread
+    cdef workspace *ws = &arena.ws
+    if num_threads > 1:
+        ws = <workspace *>calloc(num_threads, sizeof(workspace))
+        if ws == NULL:
+            raise MemoryError()
+    try:
+        if num_threads == 1:
+            with nogil:
+                for p in range(count):
+                    out[p] = distance_c(a.buffer + a.offsets[p], a.offsets[p + 1] - a.offsets[p],
+                                        b.buffer + b.offsets[p], b.offsets[p + 1] - b.offsets[p],
+                                        substitution_cost, max_distance, ws)
+                    if out[p] < 0:
+                        break
+        else:
+            for p in prange(count, nogil=True, num_threads=num_threads,
+                            schedule='dynamic', chunksize=64):
+                out[p] = distance_c(a.buffer + a.offsets[p], a.offsets[p + 1] - a.offsets[p],
+                                    b.buffer + b.offsets[p], b.offsets[p + 1] - b.offsets[p],
+                                    substitution_cost, max_distance, ws + threadid())
+    finally:
+        if num_threads > 1:
+            for p in range(num_threads):
+                workspace_free(ws + p)
+            free(ws)
+        else:
+            arena.release()
+        if profile is not None:
+            profile.lap('editdistance_batch', start)
+    if count and distances.min() < 0:
+        raise MemoryError()
+    return distances
+
+
+cpdef list editops_batch(hyps, refs, int substitution_cost=1,
+                         Py_ssize_t linear_space_threshold=LINEAR_SPACE_THRESHOLD,
+                         Py_ssize_t max_distance=-1):
+    """Compute the edit operations of each (hyp, ref) pair (None for pairs exceeding
+    max_distance), releasing the GIL over the whole batch and reusing one workspace
+
+    hyps and refs are sequences of strings or their pre-decoded CodePoints"""
+    profile = profiling.current
+    if profile is not None:
+        start = profiling.clock()
+    cdef CodePoints a = as_code_points(hyps)
+    cdef CodePoints b = as_code_points(refs)
+    cdef Py_ssize_t p, status = 0, total = 0, count = a.count
+    if b.count != count:
+        raise ValueError('expected as many references (%d) as hypotheses (%d)' % (b.count, count))
+    cdef Arena arena = thread_arena()
+    cdef workspace *ws = &arena.ws
+    # the range of each pair's edit operations within the workspace
+    cdef Py_ssize_t *starts = <Py_ssize_t *>malloc(2 * (count + 1) * sizeof(Py_ssize_t))
+    cdef Py_ssize_t *stops
+    cdef list ops = []
+    if starts == NULL:
+        raise MemoryError()
+    stops = starts + count + 1
+    try:
+        with nogil:
+            for p in range(count):
+                starts[p] = total
+                status = editops_c(a.buffer + a.offsets[p], a.offsets[p + 1] - a.offsets[p],
+                                   b.buffer + b.offsets[p], b.offsets[p + 1] - b.offsets[p],
+                                   substitution_cost, linear_space_threshold, max_distance, ws, total)
+                if status == FAILED_ALLOCATION:
+                    break
+                if status == EXCEEDED_MAX_DISTANCE:
+                    stops[p] = -1
+                else:
+                    stops[p] = total = status
+        if status == FAILED_ALLOCATION:
+            raise MemoryError()
+        for p in range(count):
+            if stops[p] < 0:
+                ops.append(None)
+            else:
+                ops.append(ops_list(<edit_op *>ws.ops.data, starts[p], stops[p]))
+    finally:
+        free(starts)
+        arena.release()
+        if profile is not None:
+            profile.lap('editops_batch', start)
+    return ops
+
+
+cpdef _editdistance_dp(str s, str t, int substitution_cost=1):
     """Exposed python wrapper to compute cost matrix and return edit distance"""
-    # remove common prefix/suffix of s and t resulting in u and v
-    cdef int i = len(s)
-    cdef int j = len(t)
-    cdef int offset = 0
-    while (i > 0 and j > 0 and s[offset] == t[offset]):
-        i -= 1
-        j -= 1
-        offset += 1
-    while (i > 0 and j > 0 and s[i - 1 + offset] == t[j - 1 + offset]):
-        i -= 1
-        j -= 1
-    cdef str u = s[offset:offset + i]
-    cdef str v = t[offset:offset + j]
-    # compute the cost matrix of transforming u to v
-    cdef int [:, :] d = cost_matrix_c(u, v, i, j, substitution_cost)
-    # edit distance is the bottom right corner of the cost matrix (no need to decode)
-    return d[i, j]
+    cdef Py_ssize_t i = len(s)
+    cdef Py_ssize_t j = len(t)
+    cdef Py_ssize_t offset = 0
+    cdef int *d = NULL
+    cdef symbol *a = <symbol *>PyUnicode_AsUCS4Copy(s)
+    cdef symbol *b = NULL
+    try:
+        b = <symbol *>PyUnicode_AsUCS4Copy(t)
+        # remove common prefix/suffix of s and t
+        while (i > 0 and j > 0 and a[offset] == b[offset]):
+            i -= 1
+            j -= 1
+            offset += 1
+        while (i > 0 and j > 0 and a[i - 1 + offset] == b[j - 1 + offset]):
+            i -= 1
+            j -= 1
+        # compute the cost matrix of transforming s to t
+        d = <int *>malloc((i + 1) * (j + 1) * sizeof(int))
+        if d == NULL:
+            raise MemoryError()
+        cost_matrix_c(a + offset, b + offset, i, j, substitution_cost, d)
+        # edit distance is the bottom right corner of the cost matrix (no need to decode)
+        return d[i * (j + 1) + j]
+    finally:
+        PyMem_Free(a)
+        PyMem_Free(b)
+        free(d)
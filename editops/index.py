@@ -0,0 +1,86 @@
+"""Lookup of the references nearest (by edit distance) to a hypothesis, for pairing
+hypotheses and references which arrive unpaired, through a q-gram inverted index
+of the references whose candidates are verified with `editdistance`"""
+import bisect
+import collections
+import math
+from .editops import editdistance
+
+
+def qgrams(text, q):
+    """The (overlapping) q-grams of text, in order"""
+    return [text[p:p + q] for p in range(len(text) - q + 1)]
+
+
+class ReferenceIndex:
+    """An inverted index from each q-gram to the references containing it
+
+    Each edit operation destroys at most q of the q-grams of a hypothesis, so a
+    reference within distance d of it must contain all but d * q of its q-grams, and
+    so at least one of any d * q + 1 of them (prefix filtering, where the rarest
+    q-grams are taken so that the fewest references are candidates). Candidates are
+    verified with `editdistance` bounded by the distance of the nearest references
+    found so far, which in turn shortens the prefix. References too short to share
+    any q-gram are found by length.
+    """
+
+    def __init__(self, refs, q=3):
+        self.refs = list(refs)
+        self.q = q
+        self.postings = collections.defaultdict(list)
+        for k, ref in enumerate(self.refs):
+            for gram in set(qgrams(ref, q)):
+                self.postings[gram].append(k)
+        self.by_length = sorted((len(ref), k) for k, ref in enumerate(self.refs))
+        self.lengths = [length for length, k in self.by_length]
+
+
+    def __len__(self):
+        return len(self.refs)
+
+
+    def nearest(self, hyp, max_distance, count=1):
+        """Return up to count (distance, id) pairs of the references nearest to hyp
+        within max_distance (nearest first, ties broken by id)"""
+        n, q, refs = len(hyp), self.q, self.refs
+        empty = ()
+        postings = [self.postings.get(gram, empty) for gram in qgrams(hyp, q)]
+        postings.sort(key=len)
+        found, checked = [], set()
+        bound = max_distance
+
+        def verify(k):
+            nonlocal bound
+            checked.add(k)
+            if abs(len(refs[k]) - n) <= bound:
+                d = editdistance(hyp, refs[k], max_distance=bound)
+                if d <= bound:
+                    bisect.insort(found, (d, k))
+                    if len(found) > count:
+                        found.pop()
+                    if len(found) == count:
+                        # only nearer references can still be among the nearest
+                        bound = found[-1][0]
+
+        x = 0
+        while x < len(postings) and x <= bound * q:
+            for k in postings[x]:
+                if k not in checked:
+                    verify(k)
+            x += 1
+        if x == len(postings) and x <= bound * q:
+            # references sharing no q-grams with hyp can be within bound
+            lo = bisect.bisect_left(self.lengths, n - bound)
+            hi = bisect.bisect_right(self.lengths, n + bound)
+            for length, k in self.by_length[lo:hi]:
+                if k not in checked:
+                    verify(k)
+        return found
+
+
+    def pair(self, hyps, max_rate=50.0):
+        """Yield each hypothesis with its nearest reference (or None if there is no
+        reference within max_rate percent edits of the hypothesis length)"""
+        for hyp in hyps:
+            found = self.nearest(hyp, math.floor(max_rate * len(hyp) / 100.0))
+            yield hyp, (self.refs[found[0][1]] if found else None)
@@ -0,0 +1,111 @@
+"""Opt-in accounting of the wall time and calls spent in each stage of scoring
+(tokenization, vocabulary mapping, edit operations, alignment bookkeeping,
+n-grams, weighting, serialization, ...) across all `Alignment` instances and
+calls of the `editops` functions (each of which is timed as a stage of its own)
+
+    with Profile() as profile:
+        for hyp, ref in pairs:
+            Alignment(hyp, ref).analysis
+    print(profile.report())
+
+Stages are timed only while a profile is active (it is a process wide setting),
+costing a single global lookup per timed stage otherwise.
+"""
+import contextlib
+import time
+
+# the profile accumulating stage timings (None when profiling is off)
+current = None
+
+clock = time.perf_counter
+
+
+class Profile:
+    """Accumulates the number of calls and seconds spent in named stages while
+    active, along with the number of pairs and characters scored"""
+
+    def __init__(self):
+        self.stages = {}
+        self.pairs = 0
+        self.chars = 0
+        self.elapsed = 0.0
+        self._previous = []
+
+
+    def __enter__(self):
+        global current
+        self._previous.append((current, clock()))
+        current = self
+        return self
+
+
+    def __exit__(self, *exc):
+        global current
+        current, start = self._previous.pop()
+        self.elapsed += clock() - start
+
+
+    def __getstate__(self):
+        return dict(stages=self.stages, pairs=self.pairs, chars=self.chars,
+                    elapsed=self.elapsed)
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._previous = []
+
+
+    def add(self, stage, seconds, calls=1):
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = [0, 0.0]
+        entry[0] += calls
+        entry[1] += seconds
+
+
+    def lap(self, stage, start):
+        """Record the time since start under stage, returning the current time
+        (the start of the next stage)"""
+        now = clock()
+        self.add(stage, now - start)
+        return now
+
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        """Time a block of code under stage"""
+        start = clock()
+        try:
+            yield
+        finally:
+            self.lap(stage, start)
+
+
+    def count(self, pairs=0, chars=0):
+        """Count scored pairs and characters (for throughput)"""
+        self.pairs += pairs
+        self.chars += chars
+
+
+    def merge(self, other):
+        """Accumulate the stages timed by another profile (e.g. of a worker process)"""
+        for stage, (calls, seconds) in other.stages.items():
+            self.add(stage, seconds, calls)
+        return self
+
+
+    def report(self, elapsed=None):
+        """Format a table of the stages (slowest first) and the throughput"""
+        elapsed = self.elapsed if elapsed is None else elapsed
+        total = sum(seconds for calls, seconds in self.stages.values())
+        lines = ['%-16s %10s %12s %12s %8s' % ('stage', 'calls', 'total (s)', 'per call (us)', '%')]
+        stages = sorted(self.stages.items(), key=lambda item: item[1][1], reverse=True)
+        for stage, (calls, seconds) in stages:
+            lines.append('%-16s %10d %12.4f %12.2f %8.1f' % (
+                stage, calls, seconds, 1e6 * seconds / calls,
+                100.0 * seconds / (total or 1.0)))
+        lines.append('%-16s %10s %12.4f' % ('total', '', total))
+        if elapsed:
+            lines.append(f'elapsed: {elapsed:.4f} s, {self.pairs / elapsed:.1f} pairs/s, '
+                         f'{self.chars / elapsed:.1f} chars/s')
+        return '\n'.join(lines)
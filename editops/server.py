@@ -0,0 +1,202 @@
+"""Scoring service speaking newline delimited JSON over a local TCP or unix socket
+
+Each request line is either a pair to score, answered (in request order per
+connection) with its edit counts and error rates:
+
+    {"id": 7, "hyp": "...", "ref": "...", "analysis": false}
+
+or a query of the running corpus level aggregates of all pairs scored so far
+(including every earlier pair of the same connection):
+
+    {"op": "aggregate"}
+
+Pairs are scored in a pool of worker processes behind a bounded queue, so a
+client sending faster than the pool can score is slowed down (its socket stops
+being read) rather than growing the server's memory.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+from editops import Alignment, score_pair
+
+logger = logging.getLogger(__name__)
+
+
+def score(hyp, ref, analysis=False):
+    """Score a single pair (in a worker process) as a response dictionary"""
+    if analysis:
+        a = Alignment(hyp, ref)
+        counts = a.error_counts()
+    else:
+        counts = score_pair(hyp, ref)
+    response = counts._asdict()
+    response['WER'] = 100.0 * counts.word_edits / (counts.ref_words or 1)
+    response['CER'] = 100.0 * counts.char_edits / (counts.ref_chars or 1)
+    if analysis:
+        response['analysis'] = a.analysis
+    return response
+
+
+class ScoringServer:
+    """Serve scoring requests with jobs worker processes, holding at most queue_size
+    requests which are waiting for a worker"""
+
+    def __init__(self, jobs=1, queue_size=1024):
+        self.jobs = jobs
+        self.queue_size = queue_size
+        self.totals = dict(samples=0, char_edits=0, word_edits=0, ref_chars=0, ref_words=0)
+        self.executor = None
+        self.server = None
+        self.workers = []
+
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        """Start listening on host:port (or the unix socket at path)"""
+        self.queue = asyncio.Queue(self.queue_size)
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.jobs)
+        # enough workers to keep every process busy while results are collected
+        self.workers = [asyncio.ensure_future(self.work()) for _ in range(2 * self.jobs)]
+        if path is None:
+            self.server = await asyncio.start_server(self.handle, host, port, limit=1 << 24)
+        else:
+            self.server = await asyncio.start_unix_server(self.handle, path, limit=1 << 24)
+        return self.server
+
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.executor.shutdown()
+
+
+    def aggregate(self):
+        """Corpus level counts and error rates of the pairs scored so far"""
+        totals = dict(self.totals)
+        totals['WER'] = 100.0 * totals['word_edits'] / (totals['ref_words'] or 1)
+        totals['CER'] = 100.0 * totals['char_edits'] / (totals['ref_chars'] or 1)
+        return totals
+
+
+    async def handle(self, reader, writer):
+        """Read the requests of a connection, queueing pairs for the workers and
+        handing the futures of their responses (in order) to a sender"""
+        loop = asyncio.get_running_loop()
+        # at most queue_size responses awaiting the sender (a client which stops reading
+        # stops its requests being read)
+        responses = asyncio.Queue(self.queue_size)
+        sender = asyncio.ensure_future(self.send(responses, writer))
+        handler = asyncio.current_task()
+        reading = True
+
+        def stopped(sender):
+            # report a failure of the sender (other than the client disconnecting)
+            if not sender.cancelled():
+                error = sender.exception()
+                if error is not None and not isinstance(error, ConnectionError):
+                    logger.error('failed to send a response', exc_info=error)
+            # a sender which stops early would leave the reading below blocked on a
+            # full queue, so it cancels the reading
+            if reading:
+                handler.cancel()
+
+        sender.add_done_callback(stopped)
+        try:
+            async for line in reader:
+                if not line.strip():
+                    continue
+                response = loop.create_future()
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('expected a JSON object')
+                except ValueError as e:
+                    response.set_result({'error': f'invalid request: {e}'})
+                else:
+                    if request.get('op') == 'aggregate':
+                        # computed once the earlier requests of the connection are answered
+                        response = self.aggregate
+                    else:
+                        # blocks (stops reading the connection) while the queue is full
+                        await self.queue.put((request, response))
+                await responses.put(response)
+            await responses.put(None)
+            reading = False
+            # (any failure of the sender is reported by stopped)
+            await asyncio.wait((sender, ))
+        except (asyncio.CancelledError, ConnectionError):
+            # the server is shutting down or the client disconnected (the connection
+            # is simply closed)
+            pass
+        finally:
+            sender.cancel()
+            writer.close()
+
+
+    async def send(self, responses, writer):
+        """Write each response of a connection once it is ready"""
+        while True:
+            response = await responses.get()
+            if response is None:
+                return
+            response = response() if callable(response) else await response
+            try:
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+            except ConnectionError:
+                # the client disconnected (the remaining responses are dropped)
+                return
+
+
+    async def work(self):
+        """Score queued requests in the worker pool"""
+        loop = asyncio.get_running_loop()
+        while True:
+            request, response = await self.queue.get()
+            try:
+                result = await loop.run_in_executor(
+                    self.executor, score, request['hyp'], request['ref'],
+                    bool(request.get('analysis', False)))
+            except Exception as e:
+                result = {'error': f'{type(e).__name__}: {e}'}
+            else:
+                self.totals['samples'] += 1
+                for key in ('char_edits', 'word_edits', 'ref_chars', 'ref_words'):
+                    self.totals[key] += result[key]
+            if 'id' in request:
+                result['id'] = request['id']
+            response.set_result(result)
+
+
+async def serve(host, port, path, jobs, queue_size):
+    server = ScoringServer(jobs, queue_size)
+    await server.start(host, port, path)
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve scoring of hyp/ref pairs')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Address on which to listen')
+    parser.add_argument('--port', default=8765, type=int,
+                        help='Port on which to listen')
+    parser.add_argument('--unix', default=None,
+                        help='Optional path of a unix socket on which to listen instead')
+    parser.add_argument('-j', '--jobs', default=1, type=int,
+                        help='Number of worker processes scoring pairs (0 for all cores)')
+    parser.add_argument('--queue-size', default=1024, type=int,
+                        help='Number of requests waiting for a worker before reading stalls')
+    args = parser.parse_args()
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, jobs, args.queue_size))
+    except KeyboardInterrupt:
+        pass
@@ -1,8 +1,56 @@
+import os
+import sys
+import tempfile
 from setuptools import setup, find_packages
+from setuptools.command.build_ext import build_ext
+from setuptools.errors import CompileError, LinkError
 from setuptools.extension import Extension
 from Cython.Build import cythonize
-import numpy as np
+
+# batch scoring is parallelized with OpenMP where the compiler supports it
+# (without these flags prange simply runs serially)
+if sys.platform == 'win32':
+    openmp_compile_args, openmp_link_args = ['/openmp'], []
+elif sys.platform == 'darwin':
+    openmp_compile_args, openmp_link_args = [], []
+else:
+    openmp_compile_args, openmp_link_args = ['-fopenmp'], ['-fopenmp']
+
+
+def openmp_supported(compiler):
+    """Check whether compiler can build and link a program using OpenMP"""
+    with tempfile.TemporaryDirectory() as path:
+        source = os.path.join(path, 'openmp.c')
+        with open(source, 'w') as f:
+            f.write('#include <omp.h>\nint main(void) { return omp_get_num_threads() < 1; }\n')
+        try:
+            objects = compiler.compile([source], output_dir=path,
+                                       extra_postargs=openmp_compile_args)
+            compiler.link_executable(objects, os.path.join(path, 'openmp'),
+                                     extra_postargs=openmp_link_args)
+        except (CompileError, LinkError):
+            return False
+    return True
+
+
+class BuildExt(build_ext):
+    """Build without the OpenMP flags when EDITOPS_NO_OPENMP=1 is set or the compiler
+    does not support OpenMP (e.g. clang without libomp)"""
+
+    def build_extensions(self):
+        if openmp_compile_args and (os.environ.get('EDITOPS_NO_OPENMP') == '1' or
+                                    not openmp_supported(self.compiler)):
+            print('building without OpenMP (batch scoring runs serially)')
+            for extension in self.extensions:
+                extension.extra_compile_args = [
+                    arg for arg in extension.extra_compile_args if arg not in openmp_compile_args]
+                extension.extra_link_args = [
+                    arg for arg in extension.extra_link_args if arg not in openmp_link_args]
+        super().build_extensions()
+
 
 extensions = cythonize(Extension(
-    "editops.editops", ["editops/editops.pyx"], include_dirs=[np.get_include()]))
-setup(name="editops", packages=find_packages(), ext_modules=extensions)
+    "editops.editops", ["editops/editops.pyx"],
+    extra_compile_args=openmp_compile_args, extra_link_args=openmp_link_args))
+setup(name="editops", packages=find_packages(), ext_modules=extensions,
+      cmdclass={'build_ext': BuildExt})
@@ -1,4 +1,8 @@
-from editops import Alignment
+import pickle
+from editops import Alignment, Aggregator, CompiledWeights, Profile, Vocabulary
+from editops import profiling
+from editops import editops, editdistance_batch, PreparedReference
+from editops.cache import ResultCache
 
 
 def test_repr():
@@ -49,6 +53,25 @@ def test_weights():
     assert analysis['WIL'] < analysis['SWIL'] and analysis['SWIL'] == 100
 
 
+def test_compiled_weights():
+    a, b = 'version of a string one', 'another version of it'
+    salient = ('SWER', 'SNWER', 'SMER', 'SWIL')
+    for weights, default_weight in (({}, 1), ({'of': 0}, 1), ({'another': 0, 'it': 2}, 0.5)):
+        compiled = CompiledWeights(weights, default_weight)
+        shared = Alignment(a, b, weights=compiled).analysis
+        analysis = Alignment(a, b, weights=weights, default_weight=default_weight).analysis
+        for metric in salient:
+            assert abs(shared[metric] - analysis[metric]) < 1e-9
+    assert compiled['it'] == 2 and compiled['of'] == 0.5
+    # the default weight of compiled weights cannot be overridden
+    assert Alignment(a, b, weights=compiled, default_weight=0.5).SWER == shared['SWER']
+    try:
+        Alignment(a, b, weights=compiled, default_weight=1.0)
+        assert False
+    except ValueError:
+        pass
+
+
 def test_word_level_analysis():
     """Examples taken from table 1 from:
 
@@ -150,7 +173,189 @@ def test_word_level_analysis():
     assert analysis['SWIL'] == analysis['WIL']
 
 
+def test_linear_space_alignment():
+    a, b = 'version of a string one two three', 'another version of it two three four'
+    full = Alignment(a, b).analysis
+    linear = Alignment(a, b, linear_space_threshold=0).analysis
+    for k in ('H', 'S', 'D', 'I', 'N1', 'N2', 'WER', 'MER', 'WIL'):
+        assert full[k] == linear[k]
+
+
+def test_below():
+    a, b = 'version of a string one', 'another version of it'
+    WER, CER = Alignment(a, b).WER, Alignment(a, b).CER
+    for threshold in (0, WER - 1, WER, WER + 1, 1000):
+        assert Alignment(a, b).WER_below(threshold) == (WER < threshold)
+    for threshold in (0, CER - 1, CER, CER + 1, 1000):
+        assert Alignment(a, b).CER_below(threshold) == (CER < threshold)
+    assert Alignment('x y', '').WER_below(250)
+    assert not Alignment('x y', '').WER_below(200)
+    a = Alignment('x y z', 'x y x')
+    assert a.WER_below(50) and a.word_distance == 1
+
+
+def test_ngrams():
+    a = Alignment('a b a b c', 'a b a b d a b', m=1, n=2)
+    assert a.analysis['correct_grams'] == [('a', ), ('b', ), ('a', ), ('b', ),
+                                           ('a', 'b'), ('b', 'a'), ('a', 'b')]
+    assert a.analysis['incorrect_grams'] == [('d', ), ('a', ), ('b', ),
+                                             ('b', 'd'), ('d', 'a'), ('a', 'b')]
+
+
+def test_error_counts():
+    for a, b in (('version of a string one', 'another version of it'), ('', ' x  y'), ('x', '')):
+        counts = Alignment(a, b).error_counts()
+        alignment = Alignment(a, b)
+        assert counts == (alignment.char_distance, alignment.word_distance,
+                          alignment.N1_char, alignment.N1_word)
+        assert counts.word_edits == alignment.word_distance
+        assert alignment.error_counts() == counts
+
+
+def test_vocabulary():
+    vocabulary = Vocabulary()
+    a, b = 'version of a string one', 'another version of it'
+    shared = Alignment(a, b, vocabulary=vocabulary)
+    assert shared.analysis == Alignment(a, b).analysis
+    assert shared.word_distance == Alignment(a, b).word_distance
+    assert len(vocabulary) == 7 and 'another' in vocabulary
+    ids = vocabulary.encode(['of', 'it', 'new'])
+    assert list(ids) == [1, 6, 7] and vocabulary.decode(ids) == ['of', 'it', 'new']
+
+
+def test_compact_alignment():
+    a = Alignment('x y z w', 'x z w v')
+    assert not hasattr(a, '__dict__')
+    assert list(a) == [
+        ({'text': 'x', 'correct': True}, {'text': 'x', 'correct': True}),
+        ({'text': 'y', 'correct': False}, {'text': None, 'correct': False}),
+        ({'text': 'z', 'correct': True}, {'text': 'z', 'correct': True}),
+        ({'text': 'w', 'correct': True}, {'text': 'w', 'correct': True}),
+        ({'text': None, 'correct': False}, {'text': 'v', 'correct': False}),
+    ]
+    assert Alignment('x y z w', 'x z w').mirror_editops([1, 2, 3, 4]) == [1, 3, 4]
+    shared = Alignment('x y z w', 'x z w v', vocabulary=Vocabulary())
+    assert list(shared) == list(a) and shared.analysis == a.analysis
+
+
+def test_cached_alignment():
+    cache = ResultCache(maxsize=2)
+    pairs = [('x y z w', 'x z w v'), ('a b', 'b c'), ('', 'a'), ('x y z w', 'x z w v')]
+    for a, b in pairs:
+        for word_level in (True, False):
+            cached = Alignment(a, b, word_level=word_level, cache=cache)
+            expected = Alignment(a, b, word_level=word_level)
+            assert list(cached) == list(expected)
+            assert cached.analysis == expected.analysis
+    assert len(cache) == 2 and cache.hits == 0
+    list(Alignment(*pairs[3], word_level=False, cache=cache))
+    assert cache.hits == 1
+    # the threshold can change which of the optimal alignments is found
+    list(Alignment(*pairs[3], word_level=False, cache=cache, linear_space_threshold=0))
+    assert cache.hits == 1
+
+
+def test_aggregator():
+    hyps = ['the cat sat on a mat', 'a dog', 'the dog sat on the cat', '']
+    refs = ['the cat sat on the mat', 'the dog', 'a dog sat on a cat', 'the end']
+    analyses, words, grams = Alignment.aggregate(hyps, refs, m=1, n=2)
+    assert len(analyses) == len(hyps)
+    assert Alignment.aggregate(hyps, refs, keep_analyses=False, m=1, n=2) == (None, words, grams)
+
+    left, right = Aggregator(), Aggregator()
+    for h, r in zip(hyps[:2], refs[:2]):
+        left.update(Alignment(h, r, m=1, n=2))
+    for h, r in zip(hyps[2:], refs[2:]):
+        right.update(Alignment(h, r, m=1, n=2))
+    assert left.merge(right).finalize() == (words, grams)
+    try:
+        Aggregator(keep_analyses=True).merge(left)
+        assert False
+    except ValueError:
+        pass
+
+    dog = [w for w in words if w['word'] == 'dog'][0]
+    assert dog['correct'] == 2 and dog['total'] == 2 and dog['precision'] == 1.0
+
+
+def test_profile():
+    a, b = 'the cat sat on the mat', 'the cat sat on a hat'
+    Alignment(a, b).analysis
+    with Profile() as profile:
+        assert profiling.current is profile
+        for _ in range(3):
+            Alignment(a, b).analysis
+        with Profile() as inner:
+            Alignment(a, b).WER
+        assert profiling.current is profile
+    assert profiling.current is None
+    assert profile.elapsed > 0
+
+    stages = ('vocabulary', 'editops', 'align', 'weights', 'ngrams', 'editdistance', 'analysis')
+    assert set(profile.stages) == set(stages + ('tokenize', ))
+    assert all(profile.stages[stage][0] == 3 for stage in stages)
+    # words for the alignment and characters for the CER
+    assert profile.stages['tokenize'][0] == 6
+    assert set(inner.stages) == {'vocabulary', 'editdistance'}
+    # the editops functions are timed when called directly too
+    with Profile() as direct:
+        editops(a, b)
+        editdistance_batch([a], [b])
+        PreparedReference(b).score([a])
+    assert set(direct.stages) == {'editops', 'editdistance_batch', 'prepared_score'}
+
+    copy = pickle.loads(pickle.dumps(profile))
+    profile.merge(copy)
+    assert all(profile.stages[stage][0] == 6 for stage in stages)
+    profile.count(pairs=6, chars=6 * len(b))
+    assert 'pairs/s' in profile.report()
+
+
+def test_fields():
+    a, b = 'the cat sat on the mat', 'the cat sat on a hat'
+    analysis = Alignment(a, b).analysis
+    names = tuple(analysis)
+    assert Alignment(a, b).fields(names) == tuple(analysis[name] for name in names)
+    # metrics alone need neither the n-grams nor the aligned text
+    with Profile() as profile:
+        assert Alignment(a, b).fields(('WER', 'H', 'CER')) == (
+            analysis['WER'], analysis['H'], analysis['CER'])
+    assert 'ngrams' not in profile.stages and 'analysis' not in profile.stages
+
+
+def test_one_to_many():
+    ref = 'the cat sat on the mat'
+    hyps = ['the cat sat on a mat', 'a cat sat on the hat', 'the cat sat on the mat', 'cat']
+    counts, alignments, best = Alignment.one_to_many(ref, hyps, m=1, n=2)
+    assert best == 2 and counts[best].word_edits == 0
+    for hyp, c, a in zip(hyps, counts, alignments):
+        expected = Alignment(hyp, ref, m=1, n=2)
+        assert c == expected.error_counts()
+        assert (a.WER, a.CER) == (expected.WER, expected.CER)
+        assert a.analysis == expected.analysis
+    assert Alignment.one_to_many(ref, []) == ([], [], None)
+    # any iterable of hypotheses, e.g. a generator
+    scored = Alignment.one_to_many(ref, (hyp for hyp in hyps), m=1, n=2)
+    assert scored[0] == counts and [a.s for a in scored[1]] == hyps and scored[2] == best
+
+    # ties on word edits are broken by character edits
+    counts, _, best = Alignment.one_to_many('the cat', ['the hat', 'the dog'])
+    assert best == 0 and counts[0].word_edits == counts[1].word_edits
+
+
 if __name__ == '__main__':
     test_repr()
     test_weights()
+    test_compiled_weights()
     test_word_level_analysis()
+    test_linear_space_alignment()
+    test_below()
+    test_ngrams()
+    test_error_counts()
+    test_vocabulary()
+    test_compact_alignment()
+    test_cached_alignment()
+    test_aggregator()
+    test_profile()
+    test_fields()
+    test_one_to_many()
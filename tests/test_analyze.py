@@ -0,0 +1,222 @@
+import io
+import json
+import os
+import random
+import tempfile
+import numpy
+import pytest
+from editops import Profile
+from editops import editdistance
+from editops.analyze import NearestPairs, PairedLines, analyze_pairs
+from editops.index import ReferenceIndex
+from editops.cache import ResultCache, dumps as cache_dumps, loads as cache_loads
+from editops.corpus import IndexedCorpus, load_index, parse_ids, parse_range
+from editops.columns import (column_names, load_columns, NpyColumnWriter, ParquetColumnWriter,
+                             METRIC_COLUMNS, TEXT_COLUMNS)
+
+
+def random_pairs(count, seed=0):
+    rng = random.Random(seed)
+    words = 'the a cat dog sat on mat hat bat'.split()
+    sentence = lambda: ' '.join(rng.choice(words) for _ in range(rng.randint(1, 12)))
+    return [(sentence(), sentence()) for _ in range(count)]
+
+
+def test_parallel_matches_serial():
+    pairs = random_pairs(500)
+    serial = list(analyze_pairs(pairs, output=True))
+    parallel = list(analyze_pairs(iter(pairs), jobs=3, chunksize=16, output=True))
+    assert len(serial) == len(pairs)
+    assert serial == parallel
+
+
+def test_paired_lines():
+    pairs = random_pairs(50)
+    hyp = io.StringIO(''.join(f'{h}\n' for h, _ in pairs))
+    ref = io.StringIO(''.join(f'{r}\n' for _, r in pairs))
+    lines = PairedLines(hyp, ref)
+    assert list(analyze_pairs(lines)) == list(analyze_pairs(pairs))
+    assert lines.count == 50 and lines.mismatch is None
+
+    hyp = io.StringIO(''.join(f'{h}\n' for h, _ in pairs))
+    ref = io.StringIO(''.join(f'{r}\n' for _, r in pairs[:30]))
+    lines = PairedLines(hyp, ref)
+    assert list(lines) == pairs[:30]
+    assert lines.count == 30 and lines.mismatch == (31, 'reference')
+
+
+def test_npy_columns():
+    pairs = random_pairs(100)
+    lines = [json.loads(line) for _, _, line in analyze_pairs(pairs, output=True)]
+    fields = column_names(text=True)
+    with tempfile.TemporaryDirectory() as path:
+        with NpyColumnWriter(path, text=True, batch_size=32) as writer:
+            for _, _, row in analyze_pairs(pairs, output=True, fields=fields):
+                writer.write(row)
+        columns = load_columns(path)
+        for name, dtype in METRIC_COLUMNS:
+            expected = [numpy.nan if line[name] is None else line[name] for line in lines]
+            assert columns[name].dtype == dtype and len(columns[name]) == len(pairs)
+            assert numpy.allclose(columns[name], expected, equal_nan=True)
+        with open(f'{path}/text.jsonl') as f:
+            texts = [json.loads(line) for line in f]
+        assert [t['aligned_reference'] for t in texts] == [l['aligned_reference'] for l in lines]
+        del columns
+
+
+def test_parquet_columns():
+    parquet = pytest.importorskip('pyarrow.parquet')
+    pairs = random_pairs(100)
+    lines = [json.loads(line) for _, _, line in analyze_pairs(pairs, output=True)]
+    fields = column_names(text=True)
+    with tempfile.TemporaryDirectory() as path:
+        path = os.path.join(path, 'metrics.parquet')
+        with ParquetColumnWriter(path, text=True, batch_size=32) as writer:
+            for _, _, row in analyze_pairs(pairs, output=True, fields=fields):
+                writer.write(row)
+        table = parquet.read_table(path)
+        assert table.num_rows == len(pairs)
+        assert parquet.ParquetFile(path).num_row_groups == 4
+        for name, dtype in METRIC_COLUMNS:
+            expected = [numpy.nan if line[name] is None else line[name] for line in lines]
+            column = table.column(name).to_numpy()
+            assert column.dtype == dtype
+            assert numpy.allclose(column, expected, equal_nan=True)
+        for name in TEXT_COLUMNS:
+            assert table.column(name).to_pylist() == [line[name] for line in lines]
+
+
+def test_cached_analysis():
+    pairs = random_pairs(300)
+    expected = list(analyze_pairs(pairs, output=True))
+    with tempfile.TemporaryDirectory() as path:
+        path = os.path.join(path, 'cache.db')
+        with ResultCache(maxsize=100, path=path) as cache:
+            assert list(analyze_pairs(pairs[:200], output=True, cache=cache)) == expected[:200]
+        with ResultCache(maxsize=100, path=path) as cache:
+            assert list(analyze_pairs(pairs, jobs=2, chunksize=16, output=True,
+                                      cache=cache)) == expected
+            # (the random pairs may repeat)
+            assert cache.hits >= 200 and cache.hits + cache.misses == len(pairs)
+
+    # results are stored as json and bytes, never pickled
+    value = ((1, 2.5, None), [b'\x00\x01', 'ü', True], float('inf'), b'')
+    assert cache_loads(cache_dumps(value)) == value
+    try:
+        cache_dumps({'a': 1})
+        assert False
+    except TypeError:
+        pass
+
+
+def test_indexed_corpus():
+    pairs = random_pairs(50) + [('', ''), ('ünïcödé', 'unicode')]
+    with tempfile.TemporaryDirectory() as path:
+        hyp_path, ref_path = os.path.join(path, 'hyp.txt'), os.path.join(path, 'ref.txt')
+        with open(hyp_path, 'w') as f:
+            f.write('\n'.join(h for h, _ in pairs))
+        with open(ref_path, 'w', newline='\r\n') as f:
+            f.write(''.join(f'{r}\n' for _, r in pairs))
+        with IndexedCorpus(hyp_path, ref_path) as corpus:
+            assert len(corpus) == len(pairs) and list(corpus) == pairs
+            assert list(corpus.select([51, 3, 3])) == [pairs[51], pairs[3], pairs[3]]
+            ids = range(len(corpus))[parse_range('-5:')]
+            assert list(corpus.select(ids)) == pairs[-5:]
+            assert [(a.s, a.t) for a in corpus.alignments([7])] == [pairs[7]]
+            # ids and range ends are checked against the corpus when given its size
+            assert parse_ids('51,-52', len(corpus)) == [51, -52]
+            assert parse_range(':52', len(corpus)) == slice(None, 52)
+            for parse, text in ((parse_ids, '3,52'), (parse_ids, '-53'), (parse_range, '0:53')):
+                try:
+                    parse(text, len(corpus))
+                    assert False
+                except ValueError:
+                    pass
+        assert os.path.exists(hyp_path + '.idx')
+
+        # stale indices are rebuilt
+        pairs = pairs[:10]
+        with open(hyp_path, 'w') as f:
+            f.write('\n'.join(h for h, _ in pairs))
+        with open(ref_path, 'w') as f:
+            f.write('\n'.join(r for _, r in pairs))
+        with IndexedCorpus(hyp_path, ref_path) as corpus:
+            assert list(corpus) == pairs
+
+        # as are indices of files rewritten with the same size
+        with open(hyp_path, 'w') as f:
+            f.write('ab\ncd\n')
+        assert list(load_index(hyp_path)) == [0, 3, 6]
+        stat = os.stat(hyp_path)
+        with open(hyp_path, 'w') as f:
+            f.write('a\nbcd\n')
+        os.utime(hyp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        try:
+            load_index(hyp_path, rebuild=False)
+            assert False
+        except ValueError:
+            pass
+        assert list(load_index(hyp_path)) == [0, 2, 6]
+        assert list(load_index(hyp_path, rebuild=False)) == [0, 2, 6]
+
+        # and truncated indices
+        with open(hyp_path + '.idx', 'r+b') as f:
+            f.truncate(os.path.getsize(hyp_path + '.idx') - 1)
+        try:
+            load_index(hyp_path, rebuild=False)
+            assert False
+        except ValueError:
+            pass
+        assert list(load_index(hyp_path)) == [0, 2, 6]
+        assert list(load_index(hyp_path, rebuild=False)) == [0, 2, 6]
+
+
+def test_profiled_analysis():
+    pairs = random_pairs(300)
+    with Profile() as serial:
+        expected = list(analyze_pairs(pairs, output=True))
+    parallel = Profile()
+    assert list(analyze_pairs(pairs, jobs=2, chunksize=16, output=True,
+                              profile=parallel)) == expected
+    assert not parallel.elapsed
+    for profile in (serial, parallel):
+        assert profile.stages['serialize'][0] == len(pairs)
+        assert profile.stages['editops'][0] == len(pairs)
+
+
+def test_reference_index():
+    rng = random.Random(4)
+    for _ in range(200):
+        refs = [''.join(rng.choice('abc ') for _ in range(rng.randint(0, 15))) for _ in range(30)]
+        index = ReferenceIndex(refs, q=rng.choice((2, 3)))
+        for _ in range(5):
+            hyp = ''.join(rng.choice('abcd ') for _ in range(rng.randint(0, 15)))
+            max_distance, count = rng.randint(0, 8), rng.randint(1, 3)
+            brute = sorted((editdistance(hyp, ref), k) for k, ref in enumerate(refs))
+            brute = [(d, k) for d, k in brute if d <= max_distance][:count]
+            assert index.nearest(hyp, max_distance, count) == brute
+
+
+def test_nearest_pairs():
+    pairs = [(h, r) for h, r in random_pairs(200) if len(r) > 10]
+    refs = [r for _, r in pairs]
+    random.Random(0).shuffle(refs)
+    # hypotheses which are exact (or near) copies of their references
+    hyps = [r for _, r in pairs[:50]] + [r[1:] for _, r in pairs[50:]] + ['zzzzzzzzzzzz']
+    paired = NearestPairs(hyps, refs, max_rate=20.0)
+    matched = list(paired)
+    assert paired.unmatched == 1 and len(matched) == len(pairs)
+    for hyp, ref in matched:
+        assert editdistance(hyp, ref) == min(editdistance(hyp, r) for r in refs)
+
+
+if __name__ == '__main__':
+    test_parallel_matches_serial()
+    test_paired_lines()
+    test_npy_columns()
+    test_parquet_columns()
+    test_cached_analysis()
+    test_indexed_corpus()
+    test_profiled_analysis()
+    test_reference_index()
+    test_nearest_pairs()
@@ -1,4 +1,15 @@
+import concurrent.futures
+import os
+import random
+import subprocess
+import sys
+from array import array
+import editops as package
 from editops import editops, editdistance
+import numpy
+from editops.editops import (_editdistance_dp, editdistance_batch, editops_batch, CodePoints,
+                             editops_ids, editdistance_ids, IncrementalAligner,
+                             PreparedReference, score_pair)
 
 
 def test_editops():
@@ -24,6 +35,275 @@ def test_editdistance():
     assert editdistance('œπ31% ^', ' πU312%') == 5
 
 
+def test_editdistance_bitparallel():
+    # lengths straddle the 64 symbol word boundaries of the blocked variant
+    rng = random.Random(0)
+    for alphabet in ('ab', 'abcdefghijklmnopqrstuvwxyz', 'aœπ€😀Āƀʀ'):
+        for m in (1, 63, 64, 65, 128, 129, 300):
+            for _ in range(10):
+                s = ''.join(rng.choice(alphabet) for _ in range(m))
+                t = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 320)))
+                assert editdistance(s, t) == _editdistance_dp(s, t)
+                assert editdistance(t, s) == _editdistance_dp(t, s)
+    assert editdistance('', 'abc') == 3
+    assert editdistance('abc', '') == 3
+    assert editdistance('xz', 'xyx', substitution_cost=2) == 3
+
+
+def test_editdistance_linear_memory():
+    rng = random.Random(1)
+    for _ in range(200):
+        s = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 40)))
+        t = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 40)))
+        for substitution_cost in (0, 1, 2, 3):
+            assert (editdistance(s, t, substitution_cost) ==
+                    _editdistance_dp(s, t, substitution_cost))
+    # a full cost matrix for this pair would need ~1.6GB
+    s = ''.join(rng.choice('abcdefgh ') for _ in range(20000))
+    t = ''.join(rng.choice('abcdefgh ') for _ in range(20000))
+    assert editdistance(s, t, 2) >= editdistance(s, t) > 0
+
+
+def apply_editops(ops, s, t):
+    """Transform s into t using the edit operations ops"""
+    out, i = [], 0
+    for op, spos, dpos in ops:
+        out.append(s[i:spos])
+        i = spos
+        if op == 'insert':
+            out.append(t[dpos])
+        elif op == 'delete':
+            i += 1
+        else:
+            out.append(t[dpos])
+            i += 1
+    out.append(s[i:])
+    return ''.join(out)
+
+
+def test_editops_linear_space():
+    rng = random.Random(2)
+    for _ in range(200):
+        s = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 60)))
+        t = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 60)))
+        for substitution_cost in (1, 2):
+            for threshold in (0, 16, 100):
+                ops = editops(s, t, substitution_cost, linear_space_threshold=threshold)
+                cost = sum(substitution_cost if op == 'replace' else 1 for op, _, _ in ops)
+                assert apply_editops(ops, s, t) == t
+                assert cost == editdistance(s, t, substitution_cost)
+    # small problems never leave the full cost matrix
+    assert editops('abcd', 'addcd', linear_space_threshold=30) == [('insert', 1, 1), ('replace', 1, 2)]
+
+
+def test_max_distance():
+    assert editdistance('abcdefgh', 'abcdefgh', max_distance=0) == 0
+    assert editdistance('xxyy', 'x', max_distance=1) == 2
+    assert editdistance('xz', 'xyx', max_distance=2) == 2
+    assert editops('xz', 'xyx', max_distance=1) is None
+    assert editops('xz', 'xyx', max_distance=2) == [('insert', 1, 1), ('replace', 1, 2)]
+    rng = random.Random(3)
+    for _ in range(300):
+        s = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 150)))
+        t = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 150)))
+        for substitution_cost in (1, 2):
+            d = _editdistance_dp(s, t, substitution_cost)
+            k = rng.randint(0, 60)
+            assert editdistance(s, t, substitution_cost, max_distance=k) == min(d, k + 1)
+            for threshold in (0, 64, 1 << 24):
+                ops = editops(s, t, substitution_cost, threshold, max_distance=k)
+                if d > k:
+                    assert ops is None
+                else:
+                    assert apply_editops(ops, s, t) == t
+                    assert sum(substitution_cost if op == 'replace' else 1
+                               for op, _, _ in ops) == d
+    # long pairs a few edits apart take the banded linear space path
+    for _ in range(50):
+        s = ''.join(rng.choice('abcd') for _ in range(rng.randint(500, 1500)))
+        t = list(s)
+        for _ in range(rng.randint(0, 20)):
+            x = rng.randrange(len(t))
+            t[x:x + 1] = rng.choice(([], ['a'], ['e', t[x]]))
+        t = ''.join(t)
+        for substitution_cost in (1, 2):
+            d = editdistance(s, t, substitution_cost)
+            for k in {max(d - 1, 0), d, d + 5}:
+                ops = editops(s, t, substitution_cost, 256, max_distance=k)
+                if d > k:
+                    assert ops is None
+                else:
+                    assert apply_editops(ops, s, t) == t
+                    assert sum(substitution_cost if op == 'replace' else 1
+                               for op, _, _ in ops) == d
+
+
+def test_batch():
+    rng = random.Random(4)
+    hyps = [''.join(rng.choice('abcœ ') for _ in range(rng.randint(0, 150))) for _ in range(100)]
+    refs = [''.join(rng.choice('abcœ ') for _ in range(rng.randint(0, 150))) for _ in range(100)]
+    for substitution_cost in (1, 2):
+        for k in (-1, 10):
+            assert list(editdistance_batch(hyps, refs, substitution_cost, k)) == [
+                editdistance(h, r, substitution_cost, k) for h, r in zip(hyps, refs)]
+            for threshold in (0, 1 << 24):
+                assert editops_batch(hyps, refs, substitution_cost, threshold, k) == [
+                    editops(h, r, substitution_cost, threshold, k) for h, r in zip(hyps, refs)]
+    assert len(editdistance_batch([], [])) == 0
+    assert editops_batch([], []) == []
+    try:
+        editdistance_batch(['x'], [])
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_parallel_batch():
+    rng = random.Random(5)
+    hyps = [''.join(rng.choice('abcœ ') for _ in range(rng.randint(0, 150))) for _ in range(500)]
+    refs = [''.join(rng.choice('abcœ ') for _ in range(rng.randint(0, 150))) for _ in range(500)]
+    expected = [editdistance(h, r) for h, r in zip(hyps, refs)]
+    a, b = CodePoints(hyps), CodePoints(refs)
+    assert len(a) == 500 and a[7] == hyps[7]
+    for num_threads in (1, 2, 4, 0):
+        assert list(editdistance_batch(a, b, num_threads=num_threads)) == expected
+    codepoints = numpy.array([ord(c) for h in hyps for c in h], dtype=numpy.uint32)
+    offsets = numpy.cumsum([0] + [len(h) for h in hyps]).astype(numpy.int64)
+    c = CodePoints.from_buffers(codepoints, offsets)
+    assert list(editdistance_batch(c, refs, num_threads=2)) == expected
+    assert editops_batch(c, b) == editops_batch(hyps, refs)
+
+
+def test_ids():
+    rng = random.Random(3)
+    for _ in range(200):
+        s = [rng.randrange(-2, 2000000) if rng.random() < 0.1 else rng.randrange(4)
+             for _ in range(rng.randint(0, 150))]
+        t = [rng.randrange(4) for _ in range(rng.randint(0, 150))]
+        # ids outside of the unicode range behave like any other symbol
+        symbols = dict((i, chr(j)) for j, i in enumerate(set(s + t)))
+        u, v = ''.join(symbols[i] for i in s), ''.join(symbols[i] for i in t)
+        a, b = array('i', s), numpy.array(t, dtype=numpy.int32)
+        assert editdistance_ids(a, b) == editdistance(u, v)
+        assert editdistance_ids(a, b, max_distance=5) == editdistance(u, v, max_distance=5)
+        assert editops_ids(a, b) == editops(u, v)
+
+
+def test_many_words():
+    # more distinct words than there are code points, so word ids exceed any code point
+    count = 0x110010
+    words = [chr(0x4e00 + k // 1200) + chr(0x4e00 + k % 1200) for k in range(count)]
+    hyp_words = words[-2:] + ['x']
+    hyp, ref = ' '.join(hyp_words), ' '.join(words)
+    hyp_ids = numpy.array([count - 2, count - 1, count], dtype=numpy.int32)
+    ref_ids = numpy.arange(count, dtype=numpy.int32)
+    d = editdistance_ids(hyp_ids, ref_ids)
+    char_edits = editdistance(''.join(hyp_words), ''.join(words))
+    assert score_pair(hyp, ref) == (char_edits, d, 2 * count, count)
+    assert PreparedReference(ref).score([hyp, words[-1]]) == [score_pair(hyp, ref),
+                                                              score_pair(words[-1], ref)]
+    aligner = IncrementalAligner(words, word_level=True)
+    assert aligner.extend(hyp_words) == d
+    assert len(aligner.editops()) == len(editops_ids(hyp_ids, ref_ids)) == d
+
+
+def test_incremental():
+    rng = random.Random(0)
+    for _ in range(200):
+        ref = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 30)))
+        aligner = IncrementalAligner(ref)
+        hyp = ''
+        for _ in range(10):
+            if hyp and rng.random() < 0.3:
+                k = rng.randint(0, len(hyp))
+                hyp = hyp[:len(hyp) - k]
+                d = aligner.retract(k)
+            else:
+                new = ''.join(rng.choice('abcde') for _ in range(rng.randint(0, 5)))
+                hyp += new
+                d = aligner.extend(new)
+            assert len(aligner) == len(hyp)
+            assert d == aligner.distance == editdistance(hyp, ref)
+            ops = aligner.editops()
+            assert len(ops) == d and apply_editops(ops, hyp, ref) == ref
+        weighted = IncrementalAligner(ref, substitution_cost=2)
+        assert weighted.extend(hyp) == editdistance(hyp, ref, substitution_cost=2)
+
+    aligner = IncrementalAligner('the cat sat on the mat', word_level=True)
+    assert aligner.extend('the bat') == 5
+    assert aligner.extend(['sat', 'on', 'the']) == 2
+    assert aligner.editops() == [('replace', 1, 1), ('insert', 5, 5)]
+    assert aligner.retract(3) == 5
+    try:
+        aligner.retract(3)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_prepared_reference():
+    rng = random.Random(3)
+    words = 'the a cat dog sat on mat hat bat'.split() + [f'x{i}' for i in range(100)]
+    sentence = lambda k: ' '.join(rng.choice(words) for _ in range(rng.randint(0, k)))
+    for _ in range(200):
+        # long enough for multiple words of bit-vectors
+        ref, hyps = sentence(80), [sentence(80) for _ in range(5)]
+        prepared = PreparedReference(ref)
+        assert prepared.score(hyps) == [score_pair(hyp, ref) for hyp in hyps]
+    assert PreparedReference('').score(['a b', '']) == [(2, 2, 0, 0), (0, 0, 0, 0)]
+    assert PreparedReference('a b').score([]) == []
+
+
+def test_prepared_reference_threads():
+    rng = random.Random(4)
+    words = 'the a cat dog sat on mat'.split() + [f'x{i}' for i in range(100)]
+    sentence = lambda: ' '.join(rng.choice(words) for _ in range(rng.randint(0, 80)))
+    # long enough for the blocked recurrence on both characters and words
+    ref = ' '.join(rng.choice(words) for _ in range(80))
+    prepared = PreparedReference(ref)
+    batches = [[sentence() for _ in range(20)] for _ in range(40)]
+    expected = [[score_pair(hyp, ref) for hyp in hyps] for hyps in batches]
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(prepared.score, batches)) == expected
+
+
+def test_thread_arenas():
+    rng = random.Random(5)
+    words = 'the a cat dog sat on mat'.split()
+    sentence = lambda: ' '.join(rng.choice(words) for _ in range(rng.randint(0, 40)))
+    pairs = [(sentence(), sentence()) for _ in range(400)]
+    # a pair large enough for the arena to free its cost matrix after the call
+    long = ''.join(rng.choice('ab') for _ in range(2100))
+    pairs.append((long, long[::-1]))
+    score = lambda pair: (editops(*pair), editdistance(*pair), score_pair(*pair))
+    expected = [score(pair) for pair in pairs]
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(score, pairs)) == expected
+    assert [score(pair) for pair in pairs] == expected
+
+
+def test_numpy_optional():
+    path = os.path.dirname(os.path.dirname(os.path.abspath(package.__file__)))
+    code = 'import sys, editops; print("numpy" in sys.modules)'
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                         env=dict(os.environ, PYTHONPATH=path), check=True)
+    assert out.stdout.strip() == 'False'
+
+
 if __name__ == '__main__':
     test_editops()
     test_editdistance()
+    test_editdistance_bitparallel()
+    test_editdistance_linear_memory()
+    test_editops_linear_space()
+    test_max_distance()
+    test_batch()
+    test_parallel_batch()
+    test_ids()
+    test_many_words()
+    test_incremental()
+    test_prepared_reference()
+    test_prepared_reference_threads()
+    test_thread_arenas()
+    test_numpy_optional()
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import logging
+from editops import score_pair
+from editops.server import ScoringServer
+
+
+async def exchange(lines):
+    server = ScoringServer(jobs=1, queue_size=2)
+    port = (await server.start('127.0.0.1', 0)).sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(''.join(f'{line}\n' for line in lines).encode('utf-8'))
+        await writer.drain()
+        responses = [json.loads(await reader.readline()) for _ in lines]
+        writer.close()
+    finally:
+        await server.close()
+    return responses
+
+
+async def disconnect(count):
+    server = ScoringServer(jobs=1, queue_size=2)
+    port = (await server.start('127.0.0.1', 0)).sockets[0].getsockname()[1]
+    try:
+        # start the worker process first (a fork would inherit and hold open the client socket)
+        await asyncio.get_running_loop().run_in_executor(server.executor, int)
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        line = json.dumps(dict(hyp='the cat sat', ref='the cat sat on the mat'))
+        writer.write(f'{line}\n'.encode('utf-8') * count)
+        await writer.drain()
+        await reader.readline()
+        handlers = [task for task in asyncio.all_tasks()
+                    if task.get_coro().__qualname__ == 'ScoringServer.handle']
+        # drop the connection with most of its responses unsent
+        writer.transport.abort()
+        await asyncio.wait_for(asyncio.gather(*handlers), 10)
+        return len(handlers)
+    finally:
+        await server.close()
+
+
+class UnserializableServer(ScoringServer):
+
+    def aggregate(self):
+        return dict(totals=object())
+
+
+class Records(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+async def failed_send():
+    server = UnserializableServer(jobs=1, queue_size=2)
+    port = (await server.start('127.0.0.1', 0)).sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(json.dumps(dict(op='aggregate')).encode('utf-8') + b'\n')
+        await writer.drain()
+        # the connection is closed (while the client is still sending) once sending fails
+        closed = await asyncio.wait_for(reader.read(), 10)
+        writer.close()
+        return closed
+    finally:
+        await server.close()
+
+
+def test_server():
+    pairs = [('the cat sat', 'the cat sat on the mat'), ('a b c', 'a c'), ('', 'x y')] * 3
+    lines = [json.dumps(dict(id=i, hyp=h, ref=r)) for i, (h, r) in enumerate(pairs)]
+    lines += ['not json', '[1, 2]', '"x"', json.dumps(dict(id='a', hyp='x', ref='y', analysis=True)),
+              json.dumps(dict(op='aggregate'))]
+    responses = asyncio.run(exchange(lines))
+    for i, (h, r) in enumerate(pairs):
+        assert responses[i]['id'] == i
+        assert tuple(responses[i][k] for k in ('char_edits', 'word_edits', 'ref_chars',
+                                               'ref_words')) == score_pair(h, r)
+    assert all('invalid request' in r['error'] for r in responses[len(pairs):len(pairs) + 3])
+    assert responses[-2]['analysis']['WER'] == 100.0
+    totals = responses[-1]
+    assert totals['samples'] == len(pairs) + 1
+    assert totals['word_edits'] == sum(score_pair(h, r).word_edits for h, r in pairs) + 1
+
+
+def test_disconnect():
+    # the connection's handler finishes rather than waiting forever to queue responses
+    assert asyncio.run(disconnect(1000)) == 1
+
+
+
+def test_failed_send():
+    records = Records()
+    logger = logging.getLogger('editops.server')
+    logger.addHandler(records)
+    try:
+        assert asyncio.run(failed_send()) == b''
+    finally:
+        logger.removeHandler(records)
+    assert [r.exc_info[0] for r in records.records] == [TypeError]
+
+
+if __name__ == '__main__':
+    test_server()
+    test_disconnect()
+    test_failed_send()